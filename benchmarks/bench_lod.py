@@ -0,0 +1,47 @@
+"""Compare incremental updates of the min/max pyramid with a full rebuild.
+
+Usage: python benchmarks/bench_lod.py [samples ...]
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from graphysio.plotwidgets.lod import MinMaxPyramid
+
+
+def same_levels(a: MinMaxPyramid, b: MinMaxPyramid) -> bool:
+    if len(a.levels) != len(b.levels):
+        return False
+    return all(
+        np.array_equal(la.x, lb.x)
+        and np.array_equal(la.ymin, lb.ymin)
+        and np.array_equal(la.ymax, lb.ymax)
+        for la, lb in zip(a.levels, b.levels)
+    )
+
+
+def main(sizes) -> None:
+    rng = np.random.default_rng(0)
+    for n in sizes:
+        x = np.arange(n, dtype=np.int64)
+        y = rng.normal(size=n)
+        # Grow the curve in steps, crossing the creation of new levels
+        start = n // 10
+        pyramid = MinMaxPyramid(x[:start], y[:start])
+        t0 = time.perf_counter()
+        for stop in np.linspace(start, n, 8, dtype=int)[1:]:
+            pyramid.update(x[:stop], y[:stop], start)
+            start = stop
+        incremental = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        fresh = MinMaxPyramid(x, y)
+        rebuild = time.perf_counter() - t0
+        assert same_levels(pyramid, fresh)
+        print(f"{n} samples: updates {incremental:.3f}s, rebuild {rebuild:.3f}s")
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [300_000, 3_000_000, 30_000_000]
+    main(sizes)
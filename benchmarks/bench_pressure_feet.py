@@ -0,0 +1,82 @@
+"""Compare the location of pressure feet with the former per-cycle code.
+
+Usage: python benchmarks/bench_pressure_feet.py [hours ...]
+"""
+
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from graphysio.algorithms.waveform import (
+    CurveData,
+    argExtremum,
+    findPressureRisings,
+)
+
+SAMPLERATE = 125
+
+
+def synthetic_pressure(hours, samplerate=SAMPLERATE, seed=0):
+    rng = np.random.default_rng(seed)
+    n = int(hours * 3600 * samplerate)
+    t = np.arange(n) / samplerate
+    # Heart rate drifting between 60 and 100 bpm
+    rate = 1.3 + 0.3 * np.sin(2 * np.pi * t / 600)
+    phase = np.cumsum(rate) / samplerate % 1
+    upstroke = np.sin(np.clip(phase / 0.15, 0, 1) * np.pi / 2)
+    runoff = np.exp(-np.clip(phase - 0.15, 0, None) * 3)
+    wave = 80 + 40 * np.where(phase < 0.15, upstroke, runoff)
+    wave += rng.normal(0, 0.3, n)
+    index = np.arange(n, dtype=np.int64) * int(1e9 / samplerate)
+    return pd.Series(wave, index=index)
+
+
+def legacy_maxima(sndderiv, risingStarts, risingStops):
+    def locateMaxima():
+        for start, stop in zip(risingStarts, risingStops):
+            idxstart = sndderiv.index[start]
+            idxstop = sndderiv.index[stop]
+            try:
+                maximum = sndderiv.loc[idxstart:idxstop].idxmax()
+            except ValueError:
+                continue
+            else:
+                yield maximum
+
+    return pd.Index(list(locateMaxima()))
+
+
+def vectorized_maxima(sndderiv, risingStarts, risingStops):
+    maxima = argExtremum(sndderiv.to_numpy(), risingStarts, risingStops, "max")
+    return sndderiv.index[maxima[maxima >= 0]]
+
+
+def timeit(f, *args, repeat=3):
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = f(*args)
+        best = min(best, time.perf_counter() - start)
+    return (best, result)
+
+
+def main(hours) -> None:
+    for h in hours:
+        series = synthetic_pressure(h)
+        curve = CurveData(series.index, series.to_numpy(), SAMPLERATE)
+        sndderiv, starts, stops = findPressureRisings(curve)
+        tlegacy, legacy = timeit(legacy_maxima, sndderiv, starts, stops, repeat=1)
+        tnew, new = timeit(vectorized_maxima, sndderiv, starts, stops)
+        assert np.array_equal(legacy.to_numpy(), new.to_numpy())
+        print(
+            f"{h:>4g} h, {len(new):>7} feet: "
+            f"legacy {tlegacy:8.3f} s, vectorized {tnew:6.3f} s, "
+            f"speedup x{tlegacy / tnew:.0f}",
+        )
+
+
+if __name__ == "__main__":
+    hours = [float(h) for h in sys.argv[1:]] or [1, 6, 24]
+    main(hours)
@@ -0,0 +1,105 @@
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Dict, Mapping, Optional
+
+import numexpr as ne
+import numpy as np
+import pandas as pd
+from numexpr import necompiler
+
+from graphysio.algorithms import resample
+from graphysio.algorithms.iir import CHUNKSIZE, Progress, chunks
+from graphysio.structures import channelstore
+
+
+@contextmanager
+def numthreads(nthreads: Optional[int]):
+    # None keeps the setting of numexpr, NUMEXPR_NUM_THREADS by default
+    if nthreads is None:
+        yield
+        return
+    previous = ne.set_num_threads(nthreads)
+    try:
+        yield
+    finally:
+        ne.set_num_threads(previous)
+
+
+class Expression:
+    """Formula compiled once by numexpr and evaluated chunk by chunk.
+
+    numexpr splits each chunk between its threads, the chunks bound the size
+    of the arguments which have to be prepared for one evaluation.
+    """
+
+    def __init__(self, formula: str) -> None:
+        self.formula = formula
+        try:
+            self.program = ne.NumExpr(formula)
+        except (SyntaxError, TypeError, ValueError, KeyError) as e:
+            msg = f"Invalid expression: {formula}"
+            raise ValueError(msg) from e
+        self.names = self.program.input_names
+        _, self.usesvml = necompiler.getExprNames(formula, necompiler.getContext({}))
+
+    def __call__(
+        self,
+        variables: Mapping[str, np.ndarray],
+        out: Optional[np.ndarray] = None,
+        chunksize: int = CHUNKSIZE,
+        nthreads: Optional[int] = None,
+    ) -> np.ndarray:
+        """Evaluate on whole arrays, into out if it is given."""
+        arrays = [np.asarray(variables[name], dtype=np.float64) for name in self.names]
+        if not arrays:
+            msg = "Expression without variables"
+            raise ValueError(msg)
+        n = len(arrays[0])
+        if out is None:
+            out = channelstore.allocate(n, np.float64)
+        with numthreads(nthreads):
+            for chunk in chunks(0, n, chunksize):
+                args = [array[chunk] for array in arrays]
+                self.evaluate(args, out[chunk])
+        return out
+
+    def evaluate(self, args, out: np.ndarray) -> None:
+        self.program(*args, out=out, casting="unsafe", ex_uses_vml=self.usesvml)
+
+
+@lru_cache(maxsize=64)
+def compiled(formula: str) -> Expression:
+    return Expression(formula)
+
+
+def align(series: pd.Series, times: np.ndarray) -> np.ndarray:
+    # Linear interpolation of series at times, NaN outside of the curve
+    index = series.index.to_numpy()
+    src = resample.around(index, times)
+    values = resample.evaluate(index[src], series.to_numpy()[src], times, "linear")
+    values[(times < index[0]) | (times > index[-1])] = np.nan
+    return values
+
+
+def curve_algebra(
+    formula: str,
+    sources: Dict[str, pd.Series],
+    times: np.ndarray,
+    chunksize: int = CHUNKSIZE,
+    nthreads: Optional[int] = None,
+) -> np.ndarray:
+    """Evaluate formula with its variables resampled at times.
+
+    The sources are only aligned one chunk of times at a time, memory use
+    does not depend on the union of their timestamps.
+    """
+    expression = compiled(formula)
+    out = channelstore.allocate(len(times), np.float64)
+    progress = Progress("Curve algebra", len(times))
+    with numthreads(nthreads):
+        for chunk in chunks(0, len(times), chunksize):
+            t = times[chunk]
+            args = [align(sources[name], t) for name in expression.names]
+            expression.evaluate(args, out[chunk])
+            progress(len(t))
+    return out
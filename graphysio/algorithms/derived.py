@@ -0,0 +1,46 @@
+from functools import partial
+
+from graphysio.algorithms.filters import savgol
+from graphysio.structures import DerivedCache, derivedcache
+
+
+def fstderiv(curve):
+    return curve.series.diff().shift(-1)
+
+
+def sndderiv(curve):
+    return curve.derived("fstderiv").diff().shift(-1)
+
+
+def smoothsndderiv(curve, window, order):
+    sndderiv = curve.series.diff().diff().iloc[1:]
+    sndderiv, _ = savgol(sndderiv, curve.samplerate, (window, order))
+    return sndderiv.dropna()
+
+
+derivations = {
+    "fstderiv": fstderiv,
+    "sndderiv": sndderiv,
+    "smoothsndderiv": smoothsndderiv,
+}
+
+
+class DerivedSignals:
+    """Access to signals derived from self.series through self.derivedcache.
+
+    Keys are prefixed with the object and its revision, so that entries are
+    missed once the samples change.
+    """
+
+    derivedcache: DerivedCache = derivedcache
+    revision = 0
+
+    def cachekey(self, *key):
+        return (self, self.revision, *key)
+
+    def cached(self, key, compute=None):
+        return self.derivedcache.get(self.cachekey(*key), compute)
+
+    def derived(self, op, *params):
+        compute = partial(derivations[op], self, *params)
+        return self.cached((op, params), compute)
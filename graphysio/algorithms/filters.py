@@ -1,17 +1,16 @@
 from copy import copy
 from datetime import datetime
 from functools import reduce
-from math import floor
+from math import comb
 from typing import Dict
 
-import numexpr as ne
 import numpy as np
 import pandas as pd
-from pint import UnitRegistry
-from scipy import interpolate, signal
+from scipy import signal
 
-from graphysio.structures import Filter, Parameter
-from graphysio.utils import truncatevecs
+from graphysio.algorithms import algebra, iir, resample
+from graphysio.structures import Filter, Parameter, Segments
+from graphysio.utils import timeUnitToNs, truncatevecs
 
 
 class TF:
@@ -26,7 +25,13 @@ class TF:
         return (np.squeeze(dnum), np.squeeze(dden))
 
 
-interpkind = ["linear", "zero", "pchip", "nearest"]
+aggregates = {
+    "mean": np.mean,
+    "median": np.median,
+    "min": np.min,
+    "max": np.max,
+    "std": np.std,
+}
 Filters = {
     "Lowpass filter": Filter(
         name="lowpass",
@@ -47,7 +52,7 @@ Filters = {
         name="interp",
         parameters=[
             Parameter("New sampling rate (Hz)", float),
-            Parameter("Interpolation type", interpkind),
+            Parameter("Interpolation type", resample.kinds),
         ],
     ),
     "Doppler cut": Filter(
@@ -77,6 +82,13 @@ Filters = {
         name="sma",
         parameters=[Parameter("Window duration", "time")],
     ),
+    "Strided aggregate": Filter(
+        name="strided",
+        parameters=[
+            Parameter("Window duration", "time"),
+            Parameter("Aggregate", list(aggregates)),
+        ],
+    ),
 }
 
 FeetFilters = {
@@ -100,6 +112,13 @@ def updateTFs() -> None:
     )
 
 
+def findSegments(series, samplerate, segments=None) -> Segments:
+    # Curves pass the runs they found, other callers get them here
+    if segments is None:
+        segments = Segments.from_index(series.index, samplerate)
+    return segments
+
+
 # -- Curve Filters --
 def norm1(series, samplerate, parameters):
     series -= np.mean(series)
@@ -117,10 +136,8 @@ def norm2(series, samplerate, parameters):
 
 def expression(series, samplerate, parameters):
     (express,) = parameters
-    try:
-        filtered = ne.evaluate(express, local_dict={"x": series.to_numpy()})
-    except Exception:
-        filtered = None
+    # Compiled once per process for all the curves
+    filtered = algebra.compiled(express)({"x": series.to_numpy()})
     newname = f"{series.name}-filtered"
     newseries = pd.Series(filtered, index=series.index, name=newname)
     return (newseries, None)
@@ -135,31 +152,55 @@ def setdatetime(series, samplerate, parameters):
     return (newseries, None)
 
 
-def sma(series, samplerate, parameters):
-    (window_s,) = parameters
-    serarr = series.to_numpy()
-    serlen = len(serarr)
+def strided(series, samplerate, parameters, segments=None):
+    window_s, aggregate = parameters
     winsize = int(window_s * samplerate)
-    nwindows = floor(serlen / winsize)
-    valstarts = np.arange(0, serlen - winsize, step=winsize)
-    resiter = (
-        np.mean(serarr[beg:end]) for beg, end in zip(valstarts, valstarts + winsize)
-    )
-    result = np.fromiter(resiter, dtype=np.float64, count=nwindows)
-    locidx = winsize * np.arange(0, nwindows) + winsize // 2
-    newname = f"{series.name}-sma{window_s}s"
+    if winsize < 1:
+        msg = "Window shorter than the sample period"
+        raise ValueError(msg)
+    values = series.to_numpy()
+    segments = findSegments(series, samplerate, segments)
+    results, locs = [], []
+    # Windows do not straddle gaps, the incomplete last window of each run
+    # is left out.
+    for start, stop in segments:
+        nwindows = (stop - start) // winsize
+        windows = values[start : start + nwindows * winsize]
+        windows = windows.reshape(nwindows, winsize)
+        results.append(aggregates[aggregate](windows, axis=1))
+        locs.append(start + winsize * np.arange(nwindows) + winsize // 2)
+    result = np.concatenate(results)
+    locidx = np.concatenate(locs)
+    prefix = "sma" if aggregate == "mean" else aggregate
+    newname = f"{series.name}-{prefix}{window_s}s"
     newseries = pd.Series(result, index=series.index[locidx], name=newname)
     newsamplerate = samplerate / winsize
     return (newseries, newsamplerate)
 
 
-def savgol(series, samplerate, parameters):
+def sma(series, samplerate, parameters, segments=None):
+    (window_s,) = parameters
+    return strided(series, samplerate, (window_s, "mean"), segments)
+
+
+def savgol(series, samplerate, parameters, segments=None):
     window, order = parameters
-    window = np.floor(window * samplerate)
-    if not window % 2:
-        # window is even, we need odd
-        window += 1
-    filtered = signal.savgol_filter(series.values, int(window), order)
+    values = series.to_numpy()
+    filtered = np.array(values, dtype=np.float64)
+    segments = findSegments(series, samplerate, segments)
+    for (start, stop), rate in zip(segments, segments.samplerates):
+        winlen = int(np.floor(window * rate))
+        if not winlen % 2:
+            # window is even, we need odd
+            winlen += 1
+        # Short runs get the longest window they can hold
+        n = stop - start
+        winlen = min(winlen, n if n % 2 else n - 1)
+        if winlen <= order:
+            # Too short to fit the polynomial
+            filtered[start:stop] = np.nan
+            continue
+        filtered[start:stop] = signal.savgol_filter(values[start:stop], winlen, order)
     newname = f"{series.name}-filtered"
     newseries = pd.Series(filtered, index=series.index, name=newname)
     return (newseries, None)
@@ -174,8 +215,7 @@ def lag(series, samplerate, parameters):
 
 
 def tf(series, samplerate, parameters):
-    (filtname,) = parameters
-    tf = TFs[filtname]
+    (tf,) = parameters
     b, a = tf.discretize(samplerate)
     filtered = signal.lfilter(b, a, series)
     newname = f"{series.name}-{tf.name}"
@@ -183,43 +223,55 @@ def tf(series, samplerate, parameters):
     return (newseries, None)
 
 
-def lowpass(series, samplerate, parameters):
+def lowpass(series, samplerate, parameters, segments=None):
     Fc, order = parameters
-    Wn = Fc * 2 / samplerate
-    b, a = signal.butter(order, Wn)
-    filtered = signal.lfilter(b, a, series)
+    segments = findSegments(series, samplerate, segments)
+    # Short runs have rough rates of their own, the curve rate is used for all
+    sos = signal.butter(order, Fc * 2 / segments.samplerate, output="sos")
+    runs = [(start, stop, sos) for start, stop in segments]
+    filtered = iir.sosfilt(runs, series.to_numpy(), label="Lowpass filter")
     newname = f"{series.name}-lp{Fc}"
     newseries = pd.Series(filtered, index=series.index, name=newname)
     return (newseries, None)
 
 
-def ventilation(series, samplerate, parameters):
+def ventilation(series, samplerate, parameters, segments=None):
     order = 12
     # Filter between 10 and 20 per minute
     bornes_hz = np.array([10, 20]) / 60
-    Wn = [Fc * 2 / samplerate for Fc in bornes_hz]
-    b, a = signal.butter(order, Wn, btype="bandstop")
-    filtered = signal.filtfilt(b, a, series.values)
+    segments = findSegments(series, samplerate, segments)
+    Wn = [Fc * 2 / segments.samplerate for Fc in bornes_hz]
+    sos = signal.butter(order, Wn, btype="bandstop", output="sos")
+    runs = [(start, stop, sos) for start, stop in segments]
+    filtered = iir.sosfiltfilt(runs, series.to_numpy(), label="Ventilation")
     newname = f"{series.name}-novent"
     newseries = pd.Series(filtered, index=series.index, name=newname)
     return (newseries, None)
 
 
-def interp(series, samplerate, parameters):
+def interp(series, samplerate, parameters, segments=None):
     newsamplerate, method = parameters
-    oldidx = series.index
-    if method == "pchip":
-        f = interpolate.PchipInterpolator(oldidx, series.values, extrapolate=True)
-    else:
-        f = interpolate.interp1d(
-            oldidx,
-            series.values,
-            kind=method,
-            fill_value="extrapolate",
-        )
-    step = 1e9 / newsamplerate  # 1e9 to convert Hz to ns
-    newidx = np.arange(oldidx[0], oldidx[-1], step, dtype=np.int64)
-    resampled = f(newidx)
+    index = series.index.to_numpy()
+    values = series.to_numpy()
+    segments = findSegments(series, samplerate, segments)
+    # Decided from the nominal rate so that all the runs are treated alike
+    factor = resample.decimation_factor(samplerate, newsamplerate)
+    if method in ("zero", "nearest"):
+        factor = None
+    # Runs are resampled one by one, leaving the gaps empty
+    newidx, resampled = [], []
+    for start, stop in segments:
+        if factor is not None:
+            # Integer downsampling, low-pass filtered against aliasing
+            newidx.append(index[start:stop:factor])
+            resampled.append(resample.decimate(values[start:stop], factor))
+            continue
+        times = resample.grid(index[start], index[stop - 1] + 1, newsamplerate)
+        newidx.append(times)
+        runidx, runvalues = index[start:stop], values[start:stop]
+        resampled.append(resample.resample(runidx, runvalues, times, method))
+    newidx = np.concatenate(newidx)
+    resampled = np.concatenate(resampled)
     newname = f"{series.name}-{newsamplerate}Hz"
     newseries = pd.Series(resampled, index=newidx, name=newname)
     return (newseries, newsamplerate)
@@ -234,10 +286,14 @@ def dopplercut(series, samplerate, parameters):
     return (newseries, None)
 
 
-def integrate(series, samplerate, parameters):
+def integrate(series, samplerate, parameters, segments=None):
     (duration,) = parameters
-    window = int(np.floor(duration * samplerate))
-    integrated = series.rolling(window, center=True).sum()
+    segments = findSegments(series, samplerate, segments)
+    runs = []
+    for (start, stop), rate in zip(segments, segments.samplerates):
+        window = int(np.floor(duration * rate))
+        runs.append(series.iloc[start:stop].rolling(window, center=True).sum())
+    integrated = pd.concat(runs)
     newname = f"{series.name}-integrate{duration}s"
     newseries = integrated.rename(newname)
     return (newseries, None)
@@ -246,13 +302,16 @@ def integrate(series, samplerate, parameters):
 def diff(series, samplerate, parameters):
     (order, timeunit) = parameters
     timeunit = timeunit.strip()
-    dy = np.diff(series.values, order)
-    dt = np.diff(series.index.values, order)
-    ureg = UnitRegistry()
-    ptu = ureg.parse_expression(timeunit)
-    conv = ptu.to(ureg.nanosecond).magnitude
-    dt = dt.astype(float) / conv
-    diffed = dy / dt
+    if order < 1:
+        msg = "Order must be at least 1"
+        raise ValueError(msg)
+    # Finite difference of the given order in one pass
+    stencil = [(-1) ** (order - k) * comb(order, k) for k in range(order + 1)]
+    dy = np.correlate(series.to_numpy(dtype=np.float64), stencil, mode="valid")
+    # Mean time step over each stencil
+    index = series.index.to_numpy()
+    dt = (index[order:] - index[:-order]) / (order * timeUnitToNs(timeunit))
+    diffed = dy / dt**order
     newname = f"{series.name}-diff{order}(/{timeunit})"
     newseries = pd.Series(diffed, index=series.index[order:], name=newname)
     return (newseries, None)
@@ -263,6 +322,7 @@ filtfuncs = {
     "lag": lag,
     "tf": tf,
     "sma": sma,
+    "strided": strided,
     "lowpass": lowpass,
     "ventilation": ventilation,
     "interp": interp,
@@ -276,12 +336,30 @@ filtfuncs = {
 }
 
 
-def filter(curve, filtname, paramgetter):
-    samplerate = curve.samplerate
-    series = curve.series
+def filter_parameters(filtname, paramgetter):
+    """Ask for the parameters of a filter, to be run with apply_filter."""
     filt = Filters[filtname]
-    parameters = map(paramgetter, filt.parameters)
-    return filtfuncs[filt.name](series, samplerate, parameters)
+    parameters = list(map(paramgetter, filt.parameters))
+    if filt.name == "tf":
+        # Transfer functions are only known to the main process
+        parameters = [TFs[tfname] for tfname in parameters]
+    elif filt.name == "expression":
+        # Invalid expressions are reported before any work is scheduled
+        (express,) = parameters
+        if algebra.compiled(express).names != ("x",):
+            msg = "The expression must use the variable x"
+            raise ValueError(msg)
+    return (filt.name, parameters)
+
+
+# Filters working run by run, see Segments
+gapaware = {"strided", "sma", "savgol", "lowpass", "ventilation", "interp", "integrate"}
+
+
+def apply_filter(series, samplerate, name, parameters, segments=None):
+    if name in gapaware:
+        return filtfuncs[name](series, samplerate, parameters, segments)
+    return filtfuncs[name](series, samplerate, parameters)
 
 
 # -- Feet Filters --
@@ -0,0 +1,100 @@
+from typing import Iterator, Optional
+
+import numpy as np
+from scipy import signal
+
+from graphysio import utils
+from graphysio.structures import channelstore
+
+# Samples filtered at once, bounds the temporary memory of the engine
+CHUNKSIZE = 1_000_000
+
+
+def chunks(start: int, stop: int, chunksize: int = CHUNKSIZE) -> Iterator[slice]:
+    for chunkstart in range(start, stop, chunksize):
+        yield slice(chunkstart, min(chunkstart + chunksize, stop))
+
+
+class SosFilter:
+    """Causal IIR filter in second-order sections.
+
+    The state is carried from one call to the next so that a signal can be
+    filtered chunk by chunk, for instance while it is being loaded.
+    """
+
+    def __init__(self, sos, zi: Optional[np.ndarray] = None) -> None:
+        self.sos = np.atleast_2d(sos)
+        self.zi = np.zeros((len(self.sos), 2)) if zi is None else zi
+
+    def __call__(self, x: np.ndarray) -> np.ndarray:
+        y, self.zi = signal.sosfilt(self.sos, x, zi=self.zi)
+        return y
+
+
+class Progress:
+    def __init__(self, label: Optional[str], total: int) -> None:
+        self.label = label
+        self.total = max(total, 1)
+        self.done = 0
+
+    def __call__(self, n: int) -> None:
+        self.done += n
+        if self.label is not None:
+            utils.reportProgress(self.label, self.done / self.total)
+
+
+def sosfilt(runs, values, label: Optional[str] = None) -> np.ndarray:
+    """Causal filtering of each run.
+
+    Runs are given as (start, stop, sos). The first run starts from a zero
+    state as with lfilter, the following ones from the steady state of their
+    first sample so that gaps do not add start-up transients.
+    """
+    out = channelstore.allocate(len(values), np.float64)
+    progress = Progress(label, len(values))
+    for n, (start, stop, sos) in enumerate(runs):
+        zi = None if n == 0 else signal.sosfilt_zi(sos) * values[start]
+        filt = SosFilter(sos, zi)
+        for chunk in chunks(start, stop):
+            out[chunk] = filt(values[chunk])
+            progress(chunk.stop - chunk.start)
+    return out
+
+
+def sosfiltfilt(runs, values, label: Optional[str] = None) -> np.ndarray:
+    """Zero-phase filtering of each run, as scipy.signal.sosfiltfilt.
+
+    Runs are given as in sosfilt. The forward pass is written to the output
+    and filtered backwards in place, chunk by chunk, so that only the chunks
+    are held in memory.
+    """
+    out = channelstore.allocate(len(values), np.float64)
+    progress = Progress(label, 2 * len(values))
+    for start, stop, sos in runs:
+        sos = np.atleast_2d(sos)
+        ntaps = 2 * len(sos) + 1
+        ntaps -= min((sos[:, 2] == 0).sum(), (sos[:, 5] == 0).sum())
+        zi = signal.sosfilt_zi(sos)
+        n = stop - start
+        if n < 2:
+            out[start:stop] = values[start:stop]
+            continue
+        # Odd extension at both ends, shorter for short runs
+        edge = min(3 * ntaps, n - 1)
+        first, last = values[start], values[stop - 1]
+        leftpad = 2 * first - values[start + 1 : start + edge + 1][::-1]
+        rightpad = 2 * last - values[stop - edge - 1 : stop - 1][::-1]
+
+        forward = SosFilter(sos, zi * leftpad[0])
+        forward(leftpad)
+        for chunk in chunks(start, stop):
+            out[chunk] = forward(values[chunk])
+            progress(chunk.stop - chunk.start)
+        rightpad = forward(rightpad)
+
+        backward = SosFilter(sos, zi * rightpad[-1])
+        backward(rightpad[::-1])
+        for chunk in reversed(list(chunks(start, stop))):
+            out[chunk] = backward(out[chunk][::-1])[::-1]
+            progress(chunk.stop - chunk.start)
+    return out
@@ -0,0 +1,194 @@
+from typing import Optional
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy import signal
+
+from graphysio.algorithms.iir import Progress, chunks
+from graphysio.structures import channelstore
+
+kinds = ["linear", "zero", "pchip", "nearest"]
+
+# Source samples kept around each chunk, enough for the PCHIP slopes
+MARGIN = 2
+
+
+def grid(start: int, stop: int, samplerate: float) -> np.ndarray:
+    """Sample times from start to stop (excluded) in ns.
+
+    Times are computed from their rank so that rounding does not build up.
+    """
+    period = 1e9 / samplerate
+    n = max(int(np.ceil((stop - start) / period)), 0)
+    k = np.arange(n, dtype=np.int64)
+    if period.is_integer():
+        return start + k * int(period)
+    return start + np.rint(k * period).astype(np.int64)
+
+
+def segment(x: np.ndarray, times: np.ndarray) -> np.ndarray:
+    # Left end of the source interval holding each time, the first and last
+    # intervals being extended for extrapolation.
+    i = x.searchsorted(times, "right") - 1
+    return np.clip(i, 0, len(x) - 2)
+
+
+def pchipslopes(h: np.ndarray, m: np.ndarray) -> np.ndarray:
+    # Same slopes as scipy.interpolate.PchipInterpolator
+    if len(m) == 1:
+        return np.repeat(m, 2)
+    w1 = 2 * h[1:] + h[:-1]
+    w2 = h[1:] + 2 * h[:-1]
+    flat = (np.sign(m[1:]) != np.sign(m[:-1])) | (m[1:] == 0) | (m[:-1] == 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        whmean = (w1 / m[:-1] + w2 / m[1:]) / (w1 + w2)
+    d = np.empty(len(m) + 1)
+    d[1:-1] = np.where(flat, 0, 1 / whmean)
+    d[0] = pchipedge(h[0], h[1], m[0], m[1])
+    d[-1] = pchipedge(h[-1], h[-2], m[-1], m[-2])
+    return d
+
+
+def pchipedge(h0, h1, m0, m1) -> float:
+    d = ((2 * h0 + h1) * m0 - h0 * m1) / (h0 + h1)
+    if np.sign(d) != np.sign(m0):
+        return 0.0
+    if np.sign(m0) != np.sign(m1) and abs(d) > 3 * abs(m0):
+        return 3 * m0
+    return d
+
+
+def evaluate(x: np.ndarray, y: np.ndarray, times: np.ndarray, kind: str):
+    """Interpolate the samples (x, y) at times, extrapolating at both ends.
+
+    x and times are int64 timestamps, differences are taken before any
+    conversion to float so that epoch timestamps keep their precision.
+    """
+    if len(x) < 2:
+        return np.full(len(times), y[0] if len(y) else np.nan, dtype=np.float64)
+    i = segment(x, times)
+    if kind == "zero":
+        i = np.where(times < x[i + 1], i, i + 1)
+        return y[i].astype(np.float64)
+    if kind == "nearest":
+        # Halfway points go to the left sample as with interp1d
+        right = times - x[i] > x[i + 1] - times
+        return y[i + right].astype(np.float64)
+
+    h = (x[i + 1] - x[i]).astype(np.float64)
+    t = (times - x[i]) / h
+    y0, y1 = y[i], y[i + 1]
+    if kind == "linear":
+        return y0 + t * (y1 - y0)
+    if kind == "pchip":
+        hs = np.diff(x).astype(np.float64)
+        d = pchipslopes(hs, np.diff(y) / hs)
+        d0, d1 = d[i] * h, d[i + 1] * h
+        t2, t3 = t * t, t * t * t
+        return (
+            y0 * (2 * t3 - 3 * t2 + 1)
+            + d0 * (t3 - 2 * t2 + t)
+            + y1 * (-2 * t3 + 3 * t2)
+            + d1 * (t3 - t2)
+        )
+    msg = f"Unknown interpolation kind: {kind}"
+    raise ValueError(msg)
+
+
+def around(x: np.ndarray, times: np.ndarray) -> slice:
+    # Source samples needed to interpolate at sorted times
+    lo = max(x.searchsorted(times[0], "right") - MARGIN, 0)
+    hi = min(x.searchsorted(times[-1], "right") + MARGIN, len(x))
+    return slice(lo, hi)
+
+
+def resample(
+    index,
+    values,
+    times: np.ndarray,
+    kind: str = "linear",
+    label: Optional[str] = None,
+) -> np.ndarray:
+    """Interpolate a curve at sorted times, chunk by chunk.
+
+    Each chunk of times only reads the source samples around it so that
+    memory use does not depend on the length of the curve.
+    """
+    x = np.asarray(index, dtype=np.int64)
+    y = np.asarray(values)
+    out = channelstore.allocate(len(times), np.float64)
+    progress = Progress(label, len(times))
+    for chunk in chunks(0, len(times)):
+        t = times[chunk]
+        src = around(x, t)
+        out[chunk] = evaluate(x[src], y[src], t, kind)
+        progress(len(t))
+    return out
+
+
+def oddextension(y: np.ndarray, length: int):
+    # Point reflection about both ends as with sosfiltfilt, short signals are
+    # then continued with their outermost value.
+    n = min(length, len(y) - 1)
+    left = 2 * y[0] - y[1 : n + 1][::-1]
+    right = 2 * y[-1] - y[len(y) - n - 1 : -1][::-1]
+    left = np.concatenate([np.full(length - n, left[0] if n else y[0]), left])
+    right = np.concatenate([right, np.full(length - n, right[-1] if n else y[-1])])
+    return (left, right)
+
+
+def ingaps(index, bounds: np.ndarray, times: np.ndarray) -> np.ndarray:
+    """Mask of the sorted times falling in a gap between two runs.
+
+    bounds are the positions of the runs, as in Segments.bounds.
+    """
+    x = np.asarray(index, dtype=np.int64)
+    gaps = bounds[1:-1]
+    if len(gaps) < 1:
+        return np.zeros(len(times), dtype=bool)
+    lasts, firsts = x[gaps - 1], x[gaps]
+    # Last gap opening before each time
+    k = lasts.searchsorted(times, "left") - 1
+    return (k >= 0) & (times < firsts[np.maximum(k, 0)])
+
+
+def decimate(values, factor: int, label: Optional[str] = None) -> np.ndarray:
+    """Polyphase downsampling by an integer factor, as scipy resample_poly.
+
+    Only the outputs which are kept are computed, with the same anti-alias
+    filter. The signal is extended by odd reflection at both ends instead of
+    zeros so that the ends of a run do not ring.
+    """
+    y = np.asarray(values, dtype=np.float64)
+    halflen = 10 * factor
+    h = signal.firwin(2 * halflen + 1, 1 / factor, window=("kaiser", 5.0))
+    nout = -(-len(y) // factor)
+    out = channelstore.allocate(nout, np.float64)
+    if nout == 0:
+        return out
+    left, right = oddextension(y, halflen)
+    progress = Progress(label, nout)
+    for chunk in chunks(0, nout):
+        # Output k is centered on input k * factor
+        lo = chunk.start * factor - halflen
+        hi = (chunk.stop - 1) * factor + halflen + 1
+        padded = np.concatenate(
+            [
+                left[lo + halflen :],
+                y[max(lo, 0) : min(hi, len(y))],
+                right[: max(hi - len(y), 0)],
+            ]
+        )
+        windows = sliding_window_view(padded, len(h))[::factor]
+        out[chunk] = windows @ h[::-1]
+        progress(chunk.stop - chunk.start)
+    return out
+
+
+def decimation_factor(samplerate: float, newsamplerate: float) -> Optional[int]:
+    # Integer ratio between the rates, if any
+    ratio = samplerate / newsamplerate
+    factor = round(ratio)
+    if factor > 1 and abs(ratio - factor) < 1e-9 * ratio:
+        return factor
+    return None
@@ -0,0 +1,247 @@
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy import signal
+
+from graphysio.algorithms.iir import CHUNKSIZE, Progress, chunks
+from graphysio.structures import channelstore
+
+windowtypes = ["hann", "hamming", "blackman", "boxcar"]
+
+
+class Spectrogram:
+    """Power spectral density over consecutive windows of a signal.
+
+    psd has one row per column of the image, centered on times (ns), and
+    one column per frequency of freqs (Hz).
+    """
+
+    def __init__(self, times: np.ndarray, freqs: np.ndarray, psd: np.ndarray) -> None:
+        self.times = times
+        self.freqs = freqs
+        self.psd = psd
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    @property
+    def nbytes(self) -> int:
+        return self.times.nbytes + self.freqs.nbytes + self.psd.nbytes
+
+
+def frames(values: np.ndarray, length: int, step: int) -> np.ndarray:
+    # Strided view on the windows of the signal, nothing is copied
+    if len(values) < length:
+        return np.empty((0, length), dtype=values.dtype)
+    return sliding_window_view(values, length)[::step]
+
+
+def spectrogram(
+    index,
+    values,
+    samplerate: float,
+    nperseg: int,
+    noverlap: int = 0,
+    window: str = "hann",
+    naverage: int = 1,
+    label: Optional[str] = None,
+) -> Spectrogram:
+    """Spectrogram of windows of nperseg samples overlapping by noverlap.
+
+    Each column is the mean of the periodograms of naverage consecutive
+    windows, as in Welch's method. The density is one-sided and scaled as
+    with scipy.signal.spectrogram. Windows are transformed in blocks, only a
+    block of them is held in memory at once.
+    """
+    hop = nperseg - noverlap
+    if nperseg < 2 or hop < 1 or naverage < 1:
+        msg = "Invalid spectrogram windows"
+        raise ValueError(msg)
+    index = np.asarray(index, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    win = signal.get_window(window, nperseg)
+    scale = 1 / (samplerate * (win**2).sum())
+    # Both halves of the spectrum except DC and Nyquist
+    onesided = slice(1, None if nperseg % 2 else -1)
+
+    windows = frames(values, nperseg, hop)
+    ncols = len(windows) // naverage
+    freqs = np.fft.rfftfreq(nperseg, 1 / samplerate)
+    psd = channelstore.allocate(ncols * len(freqs), np.float64)
+    psd = psd.reshape(ncols, len(freqs))
+    # Timestamps spanned by each column
+    spans = frames(index, (naverage - 1) * hop + nperseg, naverage * hop)
+    times = np.empty(ncols, dtype=np.int64)
+
+    progress = Progress(label, ncols)
+    blocklen = max(CHUNKSIZE // (naverage * nperseg), 1)
+    for block in chunks(0, ncols, blocklen):
+        blockwindows = windows[block.start * naverage : block.stop * naverage]
+        spec = np.fft.rfft(blockwindows * win, axis=1)
+        power = spec.real**2 + spec.imag**2
+        power = power.reshape(-1, naverage, len(freqs)).mean(axis=1)
+        power *= scale
+        power[:, onesided] *= 2
+        psd[block] = power
+        # Relative to the start so that the mean keeps its precision
+        offsets = np.rint((spans[block] - index[0]).mean(axis=1))
+        times[block] = index[0] + offsets.astype(np.int64)
+        progress(block.stop - block.start)
+    return Spectrogram(times, freqs, psd)
+
+
+# Columns per tile, the coarsest level fits in a single tile
+TILECOLS = 1024
+
+
+class SpectrogramTiles:
+    """Spectrogram tiles at several resolutions, computed on demand.
+
+    Level k averages naverage * 2**k consecutive windows per column, so that
+    coarse levels still use every window. Tile j of a level holds the columns
+    from j * TILECOLS on. Tiles are kept in self.tiles until they are evicted.
+    """
+
+    def __init__(
+        self,
+        index,
+        values,
+        samplerate: float,
+        nperseg: int,
+        noverlap: int = 0,
+        window: str = "hann",
+        naverage: int = 1,
+    ) -> None:
+        self.index = np.asarray(index, dtype=np.int64)
+        self.values = np.asarray(values, dtype=np.float64)
+        self.samplerate = samplerate
+        self.nperseg = nperseg
+        self.hop = nperseg - noverlap
+        self.window = window
+        self.naverage = naverage
+        self.tiles: Dict[Tuple[int, int], Spectrogram] = {}
+        self.toplevel = 0
+        while self.ncols(self.toplevel) > TILECOLS:
+            self.toplevel += 1
+
+    def averageAt(self, level: int) -> int:
+        # Windows averaged in each column
+        return self.naverage * 2**level
+
+    def colstep(self, level: int) -> int:
+        # Samples between the starts of two columns
+        return self.averageAt(level) * self.hop
+
+    def colspan(self, level: int) -> int:
+        return (self.averageAt(level) - 1) * self.hop + self.nperseg
+
+    def ncols(self, level: int) -> int:
+        n = len(self.values) - self.colspan(level)
+        return n // self.colstep(level) + 1 if n >= 0 else 0
+
+    def ntiles(self, level: int) -> int:
+        return -(-self.ncols(level) // TILECOLS)
+
+    def level(self, samplesperpixel: float) -> int:
+        # Coarsest level with at least a column per pixel
+        ratio = samplesperpixel / self.colstep(0)
+        level = int(np.floor(np.log2(ratio))) if ratio >= 1 else 0
+        return min(level, self.toplevel)
+
+    def visible(self, level: int, start: int, stop: int) -> List[Tuple[int, int]]:
+        """Tiles of level covering the samples from start to stop."""
+        step = self.colstep(level) * TILECOLS
+        first = max(start // step, 0)
+        last = min(stop // step, self.ntiles(level) - 1)
+        return [(level, j) for j in range(first, last + 1)]
+
+    def compute(self, level: int, j: int) -> Spectrogram:
+        # Pure function of the signal, can run in any thread
+        start = j * TILECOLS * self.colstep(level)
+        ncols = min(TILECOLS, self.ncols(level) - j * TILECOLS)
+        stop = start + (ncols - 1) * self.colstep(level) + self.colspan(level)
+        return spectrogram(
+            self.index[start:stop],
+            self.values[start:stop],
+            self.samplerate,
+            self.nperseg,
+            self.nperseg - self.hop,
+            self.window,
+            self.averageAt(level),
+        )
+
+    def get(self, key: Tuple[int, int]) -> Spectrogram:
+        if key not in self.tiles:
+            self.tiles[key] = self.compute(*key)
+        return self.tiles[key]
+
+    def evict(self, keep) -> List[Tuple[int, int]]:
+        """Drop the tiles not in keep except for the coarsest level."""
+        evicted = [k for k in self.tiles if k not in keep and k[0] != self.toplevel]
+        for key in evicted:
+            del self.tiles[key]
+        return evicted
+
+    @property
+    def nbytes(self) -> int:
+        return sum(tile.nbytes for tile in self.tiles.values())
+
+    def __getstate__(self):
+        # Workers compute their own tiles
+        state = self.__dict__.copy()
+        state["tiles"] = {}
+        return state
+
+
+# Classic EEG frequency bands in Hz
+bands = {
+    "delta": (0.5, 4),
+    "theta": (4, 8),
+    "alpha": (8, 13),
+    "beta": (13, 30),
+}
+
+
+def features(
+    spectro: Spectrogram,
+    edges: Dict[str, float],
+    bands: Dict[str, Tuple[float, float]],
+) -> Dict[str, np.ndarray]:
+    """Spectral edge frequencies and relative band powers of every column.
+
+    edges maps names to percentages of the total power, 50 giving the median
+    frequency. Columns without power have an edge frequency of 0.
+    """
+    psd, freqs = spectro.psd, spectro.freqs
+    cumpower = np.cumsum(psd, axis=1)
+    total = cumpower[:, -1:]
+    results = {}
+    for name, perc in edges.items():
+        # First frequency with more than perc % of the power below it
+        above = cumpower > perc / 100 * total
+        results[name] = freqs[np.argmax(above, axis=1)]
+    for name, (lo, hi) in bands.items():
+        ilo, ihi = freqs.searchsorted([lo, hi])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            results[name] = psd[:, ilo:ihi].sum(axis=1) / total[:, 0]
+    return results
+
+
+def extract(
+    tiles: SpectrogramTiles,
+    edges: Dict[str, float],
+    bands: Dict[str, Tuple[float, float]],
+) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """Features of the full resolution spectrogram, one tile at a time."""
+    ntiles = tiles.ntiles(0)
+    progress = Progress("Spectral features", ntiles)
+    times, results = [], []
+    for j in range(ntiles):
+        tile = tiles.compute(0, j)
+        times.append(tile.times)
+        results.append(features(tile, edges, bands))
+        progress(1)
+    names = list(edges) + list(bands)
+    merged = {name: np.concatenate([r[name] for r in results]) for name in names}
+    return (np.concatenate(times), merged)
@@ -1,29 +1,149 @@
-import itertools
+from math import ceil, floor
+from typing import Dict, Optional
 
 import numpy as np
 import pandas as pd
+from physiocurve.pandas import ECG, Pressure
+from scipy import ndimage
 
-from graphysio.utils import truncatevecs
+from graphysio.algorithms.derived import DerivedSignals
+from graphysio.structures import CycleId, DerivedCache
+from graphysio.utils import clip, truncatevecs
+
+
+class CurveData(DerivedSignals):
+    """Picklable stand-in for a curve, used to detect cycles in a worker."""
+
+    def __init__(
+        self, index, values, samplerate, feet=None, name=None, bounds=None
+    ) -> None:
+        self.series = pd.Series(values, index=index, name=name)
+        self.samplerate = samplerate
+        self.feet = dict(feet) if feet is not None else {}
+        # Positions of the runs between gaps, as in Segments.bounds
+        self.bounds = bounds
+        # Dropped along with the detection, not worth the shared budget
+        self.derivedcache = DerivedCache()
+
+    def getCycleIndices(self, vrange=None):
+        return cycleIndices(self.series.index, self.feet, vrange)
+
+
+def cycleIndices(index, feet, vrange=None):
+    hasstarts = ("start" in feet) and feet["start"].size > 0
+    hasstops = ("stop" in feet) and feet["stop"].size > 0
+    if vrange:
+        xmin, xmax = vrange
+    else:
+        xmin = index[0]
+        xmax = index[-1]
+    if not hasstarts:
+        # We have no feet, treat the whole signal as one cycle
+        locs = index.get_indexer([xmin, xmax], method="nearest")
+        indices = index[locs]
+        begins, ends = (np.array([i]) for i in indices)
+    elif not hasstops:
+        # We have no stops, starts serve as stops for previous cycle
+        begins = clip(feet["start"].values, vrange)
+        endloc = index.get_indexer([xmax], method="nearest")
+        end = index[endloc]
+        ends = np.append(begins[1:], end)
+    else:
+        # We have starts and stops, use them
+        begins = clip(feet["start"].values, vrange)
+        ends = clip(feet["stop"].values, vrange)
+
+    # Handle the case where we start in the middle of a cycle
+    while ends[0] <= begins[0]:
+        ends = ends[1:]
+
+    begins, ends = truncatevecs([begins, ends])
+    durations = ends - begins
+    return (begins, durations)
+
+
+def detectFeet(
+    index: np.ndarray,
+    values: np.ndarray,
+    samplerate: float,
+    cycleid: CycleId,
+    feet: Optional[Dict[str, pd.Index]] = None,
+    bounds: Optional[np.ndarray] = None,
+) -> Dict[str, pd.Index]:
+    """Return the points of interest found for cycleid.
+
+    Only arrays are needed so that detection can run in a worker process,
+    the result is to be merged into the POI indices of the curve. bounds
+    are the runs of the curve, found once by the curve, if known.
+    """
+    curve = CurveData(index, values, samplerate, feet, bounds=bounds)
+    found = {}
+    if cycleid is CycleId.none:
+        pass
+    elif cycleid is CycleId.velocity:
+        found["start"], found["stop"] = findFlowCycles(curve)
+    elif cycleid is CycleId.foot:
+        found["start"] = findPressureFeet(curve)
+    elif cycleid is CycleId.pressure:
+        if "start" not in curve.feet:
+            found["start"] = curve.feet["start"] = findPressureFeet(curve)
+        dia, sbp, dic = findPressureFull(curve)
+        found["diastole"] = dia
+        found["systole"] = sbp
+        found["dicrotic"] = dic
+    elif cycleid is CycleId.rwave:
+        ecg = ECG(curve.series)
+        found["rwave"] = ecg.idxrwave
+    elif cycleid is CycleId.ecg:
+        ecg = ECG(curve.series)
+        found["start"] = ecg.idxpwave
+        found["qwave"] = ecg.idxqwave
+        found["rwave"] = ecg.idxrwave
+        found["swave"] = ecg.idxswave
+        found["twave"] = ecg.idxtwave
+    elif cycleid is CycleId.foottan:
+        p = Pressure(curve.series)
+        found["start"] = p.idxtanfeet
+    elif cycleid is CycleId.pressurebis:
+        p = Pressure(curve.series)
+        found["start"] = p.idxfeet
+        found["diastole"] = p.idxdia
+        found["systole"] = p.idxsys
+        found["dicrotic"] = p.idxdic
+    else:
+        raise ValueError(cycleid)
+    return found
 
 
 def findPressureFeet(curve):
-    series = curve.series
-    samplerate = curve.samplerate
+    sndderiv, risingStarts, risingStops = findPressureRisings(curve)
+    maxima = argExtremum(sndderiv.to_numpy(), risingStarts, risingStops, "max")
+    return sndderiv.index[maxima[maxima >= 0]]
 
-    fstderiv = series.diff().shift(-1)
-    sndderiv = fstderiv.diff().shift(-1)
+
+def findPressureRisings(curve):
+    samplerate = curve.samplerate
+    fstderiv = curve.derived("fstderiv")
+    sndderiv = curve.derived("sndderiv")
 
     # Remove deceleration peaks
     sndderiv = sndderiv * (fstderiv > 0)
-
-    def performWindowing(sumcoef=4, quantcoef=3):
-        # Find pulse rising edge
-        winsum = int(samplerate / sumcoef)
+    if curve.bounds is not None:
+        # Steps across a gap are no rising edge, nor the steps next to them
+        gaps = curve.bounds[1:-1]
+        edges = np.concatenate([gaps - 2, gaps - 1])
+        sndderiv.iloc[edges[edges >= 0]] = 0
+
+    # Find pulse rising edge
+    winsum = int(samplerate / 4)
+    sndderivsq = sndderiv**2
+    integral = sndderivsq.rolling(window=winsum, center=True).sum()
+    integralarr = integral.to_numpy()
+
+    def performWindowing(quantcoef):
         winquant = int(samplerate * quantcoef)
-        sndderivsq = sndderiv**2
-        integral = sndderivsq.rolling(window=winsum, center=True).sum()
-        thres = integral.rolling(window=winquant).quantile(0.7)
-        thres = thres.bfill()
+        thres = rollingQuantile(integralarr, winquant, 0.7)
+        thres = pd.Series(thres, index=integral.index).bfill()
         risings = (integral > thres).astype(int)
         risingvar = risings.diff()
         (risingStarts,) = (risingvar > 0).to_numpy().nonzero()
@@ -33,7 +153,7 @@ def findPressureFeet(curve):
     found = False
     for quantcoef in [3, 2, 1]:
         # Try again with smaller window if we find nothing
-        risingStarts, risingStops = performWindowing(quantcoef=quantcoef)
+        risingStarts, risingStops = performWindowing(quantcoef)
         try:
             risingStops = risingStops[risingStops > risingStarts[0]]
             found = True
@@ -43,21 +163,107 @@ def findPressureFeet(curve):
 
     # Last resort: find one foot on the whole series
     if not found:
-        risingStarts = [0]
-        risingStops = [len(sndderiv) - 1]
+        risingStarts = np.array([0])
+        risingStops = np.array([len(sndderiv) - 1])
+
+    return (sndderiv, risingStarts, risingStops)
+
+
+def rollingQuantile(values, window, quantile):
+    """Trailing rolling quantile, as pandas with linear interpolation.
+
+    The order statistics of each window are taken in a single pass by the
+    rank filter of scipy. Windows which are not full or hold NaNs give NaN,
+    as do all the samples for an empty window.
+    """
+    n = len(values)
+    result = np.full(n, np.nan)
+    (finite,) = np.isfinite(values).nonzero()
+    if window < 1 or len(finite) < window:
+        return result
+    first, last = finite[0], finite[-1] + 1
+    if len(finite) < last - first:
+        # NaNs inside the signal, let pandas handle the partial windows
+        rolling = pd.Series(values).rolling(window=window)
+        return rolling.quantile(quantile).to_numpy()
+
+    span = values[first:last]
+    pos = quantile * (window - 1)
+    lo, hi = floor(pos), ceil(pos)
+    vlo = ndimage.rank_filter(span, lo, size=window, mode="nearest")
+    if hi == lo:
+        quant = vlo
+    else:
+        vhi = ndimage.rank_filter(span, hi, size=window, mode="nearest")
+        quant = vlo + (vhi - vlo) * (pos - lo)
+    # The filter window is centered, move the result to its last sample
+    shift = (window - 1) // 2
+    quant = quant[window - 1 - shift : last - first - shift]
+    result[first + window - 1 : last] = quant
+    return result
 
-    def locateMaxima():
-        for start, stop in zip(risingStarts, risingStops):
-            idxstart = sndderiv.index[start]
-            idxstop = sndderiv.index[stop]
-            try:
-                maximum = sndderiv.loc[idxstart:idxstop].idxmax()
-            except ValueError:
-                continue
-            else:
-                yield maximum
 
-    return pd.Index(list(locateMaxima()))
+def argExtremum(values, starts, stops, kind):
+    """Position of the extremum of values in each segment [start, stop].
+
+    Segments are given as inclusive positions and NaNs are ignored. The
+    position is -1 for empty segments and segments holding only NaNs.
+    """
+    _, positions = segmentExtremum(values, starts, stops, kind)
+    return positions
+
+
+def gatherSegments(starts, lengths):
+    """Positions of all the segments one after the other.
+
+    Return the positions and the offset of each segment among them, the
+    lengths need to be positive.
+    """
+    offsets = np.cumsum(lengths) - lengths
+    positions = np.repeat(starts - offsets, lengths) + np.arange(lengths.sum())
+    return (positions, offsets)
+
+
+def segmentExtremum(values, starts, stops, kind):
+    """Extremum of values in each segment [start, stop] and its position.
+
+    The extremum is NaN and the position -1 for empty segments and segments
+    holding only NaNs.
+    """
+    if kind not in ["min", "max"]:
+        raise ValueError(kind)
+    starts, stops = truncatevecs([np.asarray(starts), np.asarray(stops)])
+    extrema = np.full(len(starts), np.nan)
+    result = np.full(len(starts), -1, dtype=np.int64)
+    lengths = stops - starts + 1
+    (nonempty,) = (lengths > 0).nonzero()
+    if len(nonempty) < 1:
+        return (extrema, result)
+    starts, lengths = starts[nonempty], lengths[nonempty]
+
+    positions, offsets = gatherSegments(starts, lengths)
+    segvalues = values[positions]
+    if segvalues.dtype.kind == "f":
+        isnan = np.isnan(segvalues)
+    else:
+        isnan = np.zeros(len(segvalues), dtype=bool)
+    hasvalue = np.logical_or.reduceat(~isnan, offsets)
+
+    if kind == "max":
+        segvalues = np.where(isnan, -np.inf, segvalues)
+        segextrema = np.maximum.reduceat(segvalues, offsets)
+    else:
+        segvalues = np.where(isnan, np.inf, segvalues)
+        segextrema = np.minimum.reduceat(segvalues, offsets)
+    # First position reaching the extremum in each segment
+    isextremum = segvalues == np.repeat(segextrema, lengths)
+    candidates = np.where(isextremum, positions, np.iinfo(np.int64).max)
+    argext = np.minimum.reduceat(candidates, offsets)
+
+    found = nonempty[hasvalue]
+    extrema[found] = segextrema[hasvalue]
+    result[found] = argext[hasvalue]
+    return (extrema, result)
 
 
 def findFlowCycles(curve):
@@ -80,17 +286,14 @@ def findFlowCycles(curve):
 
 def findPressureCycles(curve):
     series = curve.series
-
-    cycles = []
     starts, durations = curve.getCycleIndices()
-    for start, duration in zip(starts, durations):
-        stop = start + duration
-        diastop = start - duration
-        dia = findPOI(series, [start, diastop], "min", windowsize=0.05, forcesign=False)
-        sbp = findPOI(series, [start, stop], "max", windowsize=0.05)
-        cycle = (dia, sbp)
-        cycles.append(cycle)
-    return [pd.Index(idx, dtype=np.int64) for idx in zip(*cycles)]
+    stops = starts + durations
+    diastops = starts - durations
+    dia = findPOIs(series, starts, diastops, "min", windowsize=0.05, forcesign=False)
+    sbp = findPOIs(series, starts, stops, "max", windowsize=0.05)
+    # Drop cycles where a point could not be placed to keep them aligned
+    found = (dia >= 0) & (sbp >= 0)
+    return [series.index[dia[found]], series.index[sbp[found]]]
 
 
 def findPressureFull(curve):
@@ -104,118 +307,172 @@ def findPressureFull(curve):
 # Utility function for point placing
 
 
-def isbetter(new, ref, kind, forcesign):
+def findPOIs(soi, begins, ends, kind, windowsize, forcesign=True):
+    """Place a point of interest in each interval [begins[i], ends[i]].
+
+    Each interval is walked from its beginning in windows of windowsize
+    seconds for as long as the extremum of the window improves on the one
+    of the previous window, or has the wrong sign when forcesign is set.
+    The point is the extremum of the last such window. Return the positions
+    of the points in soi, -1 where none could be placed.
+    """
+    if kind not in ["min", "max"]:
+        raise ValueError(kind)
+    begins = np.asarray(begins, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    values = soi.to_numpy()
+    index = soi.index.to_numpy()
+    # Window bounds are fractional, compare them as label slicing does
+    findex = index.astype(np.float64)
+    windowspan = windowsize * 1e9  # s to ns
+    if len(begins) < 1:
+        return np.empty(0, dtype=np.int64)
+
+    # One extra window past the end, it is empty and stops the walk
+    direction = np.where(ends > begins, 1, -1)
+    nwindows = (np.abs(ends - begins) // windowspan).astype(np.int64) + 2
+    offsets = np.cumsum(nwindows) - nwindows
+    cycle = np.repeat(np.arange(len(begins)), nwindows)
+    n = np.arange(nwindows.sum()) - offsets[cycle]
+    direction = direction[cycle]
+    end = ends[cycle]
+    start = begins[cycle] + (direction * n) * windowspan
+    stop = start + direction * windowspan
+    ltr = direction > 0
+    lo = findex.searchsorted(np.where(ltr, start, stop), "left")
+    hi = findex.searchsorted(np.where(ltr, stop, start), "right")
+    # Windows reaching the end of the interval stop exactly at its label
+    clipped = np.where(ltr, stop >= end, stop <= end)
+    lo = np.where(clipped & ~ltr, index.searchsorted(end, "left"), lo)
+    hi = np.where(clipped & ltr, index.searchsorted(end, "right"), hi) - 1
+
+    new, _ = segmentExtremum(values, lo, hi, kind)
+    previous = np.roll(new, 1)
     if kind == "max":
-        condition = new > ref
+        previous[offsets] = -np.inf
+        isbetter = new > previous
         if forcesign:
-            condition = condition or (new < 0)
-    elif kind == "min":
-        condition = new < ref
-        if forcesign:
-            condition = condition or (new > 0)
+            isbetter |= new < 0
     else:
-        raise ValueError(kind)
-    return condition
+        previous[offsets] = np.inf
+        isbetter = new < previous
+        if forcesign:
+            isbetter |= new > 0
+    # Empty windows end the walk as their extremum is NaN
+    failures = np.where(isbetter, nwindows[cycle], n)
+    goodwindow = np.minimum.reduceat(failures, offsets) - 1
+
+    result = np.full(len(begins), -1, dtype=np.int64)
+    (found,) = (goodwindow >= 0).nonzero()
+    windows = offsets[found] + goodwindow[found]
+    result[found] = argExtremum(values, lo[windows], hi[windows], kind)
+    return result
 
 
-def genWindows(soi, interval, windowspan):
+def findPOI(soi, interval, kind, windowsize, forcesign=True):
     begin, end = interval
-    ltr = end > begin
-    windowspan *= 1e9  # s to ns
     if begin is None or end is None:
-        return
-    direction = 1 if ltr else -1
-    for n in itertools.count():
-        start = begin + direction * n * windowspan
-        stop = start + direction * windowspan
-
-        # Stop condition if we exceed end
-        if ltr:
-            if stop >= end:
-                stop = end
-        else:
-            if stop <= end:
-                stop = end
-            start, stop = (stop, start)
+        return None
+    (pos,) = findPOIs(soi, [begin], [end], kind, windowsize, forcesign)
+    return None if pos < 0 else soi.index[pos]
 
-        window = soi.loc[start:stop]
-        if len(window) < 1:
-            return
-        yield window.index.values
 
-
-def findPOI(soi, interval, kind, windowsize, forcesign=True):
-    if kind not in ["min", "max"]:
-        raise ValueError(kind)
-    argkind = "idx" + kind
-
-    goodwindow = []
-    previous = -np.inf if kind == "max" else np.inf
-    for window in genWindows(soi, interval, windowsize):
-        zoi = soi.loc[window]
-        new = getattr(zoi, kind)()
-        if isbetter(new, previous, kind, forcesign):
-            goodwindow = window
+def nearestLoc(index, value) -> int:
+    # Position of the nearest label, ties go to the larger one
+    if index.dtype.kind in "iu":
+        # Avoid converting the whole index to float to search
+        pos = index.searchsorted(ceil(value))
+    else:
+        pos = index.searchsorted(value)
+    if pos < 1:
+        return 0
+    if pos >= len(index):
+        return len(index) - 1
+    if index[pos] - value <= value - index[pos - 1]:
+        return pos
+    return pos - 1
+
+
+class GreedyPOI:
+    """Local extrema reached by climbing a signal from each of its samples.
+
+    For every sample, the tables hold the end of the strictly improving run
+    on each side, so that a climb is a lookup once they are built.
+    """
+
+    def __init__(self, series, kind) -> None:
+        if kind not in ["min", "max"]:
+            raise ValueError(kind)
+        self.series = series
+        self.kind = kind
+        self.values = series.to_numpy()
+        n = len(self.values)
+        positions = np.arange(n)
+        if kind == "min":
+            nextisbetter = self.values[1:] < self.values[:-1]
+            previsbetter = self.values[:-1] < self.values[1:]
         else:
-            break
-        previous = new
-    finalzoi = soi.loc[goodwindow]
-    try:
-        retidx = getattr(finalzoi, argkind)()
-    except ValueError:
-        # No POI found
-        retidx = None
-    return retidx
-
-
-def findPOIGreedy(soi, start, kind):
-    if kind not in ["min", "max"]:
-        raise ValueError(kind)
-    loc = soi.index.get_loc(start, method="nearest")
-    # Find direction
-    try:
-        finddir = soi.iloc[[loc - 1, loc, loc + 1]]
-    except IndexError:
-        # We're at the edge of the curve
-        return start
-    npminmax = np.argmin if kind == "min" else np.argmax
-    direction = npminmax(finddir.values) - 1
-    if direction == 0:
-        # We're already at the local minimum
-        return start
-    curloc = loc
-    while True:
-        nextloc = curloc + direction
-        try:
-            samplesoi = soi.iloc[[curloc, nextloc]]
-        except IndexError:
+            nextisbetter = self.values[1:] > self.values[:-1]
+            previsbetter = self.values[:-1] > self.values[1:]
+        # Last sample of the improving run to the right
+        stops = np.where(np.append(nextisbetter, False), n, positions)
+        self.rightend = np.minimum.accumulate(stops[::-1])[::-1]
+        # First sample of the improving run to the left
+        stops = np.where(np.insert(previsbetter, 0, False), -1, positions)
+        self.leftend = np.maximum.accumulate(stops)
+
+    @property
+    def nbytes(self) -> int:
+        return self.rightend.nbytes + self.leftend.nbytes
+
+    def climb(self, loc: int, lo: int = 0, hi: Optional[int] = None) -> int:
+        """Position of the extremum reached from loc without leaving [lo, hi)."""
+        if hi is None:
+            hi = len(self.values)
+        if loc - 1 < lo or loc + 1 >= hi:
             # We're at the edge of the curve
-            break
-        nextisbetter = npminmax(samplesoi.values)
-        if not nextisbetter:
-            # Minimum found
-            break
-        curloc = nextloc
-    return soi.index[curloc]
+            return loc
+        npargext = np.argmin if self.kind == "min" else np.argmax
+        direction = npargext(self.values[loc - 1 : loc + 2]) - 1
+        if direction < 0:
+            return max(self.leftend[loc], lo)
+        if direction > 0:
+            return min(self.rightend[loc], hi - 1)
+        # We're already at the local extremum
+        return loc
 
 
-def distance(l1, l2, p):
-    return np.cross(l2 - l1, p - l1) / np.linalg.norm(l2 - l1)
+def findPOIGreedy(soi, start, kind):
+    loc = nearestLoc(soi.index, start)
+    return soi.index[GreedyPOI(soi, kind).climb(loc)]
 
 
 def findDicProj(series, dia, sbp, upstroke_duration):
-    dics = []
-    for si, di, up in zip(sbp, dia, upstroke_duration):
-        zoi = series.loc[si:di]
-        if len(zoi) < 1:
-            continue
-        p1 = np.array([si, zoi.iloc[0]])
-        p2 = np.array([di, zoi.iloc[-1]])
-        p3 = np.vstack([zoi.index, zoi.values]).transpose()
-        d = distance(p1, p2, p3)
-        # Limit search zone to the beginning of the segment
-        search_len = len(series.loc[si : si + 2 * up])
-        search_zone = d[0:search_len]
-        argmin = np.argmin(search_zone)
-        dics.append(zoi.index[argmin])
-    return pd.Index(dics)
+    # Dicrotic notch: farthest point below the sbp -> next dia chord,
+    # searched within twice the upstroke duration from the systole.
+    sbp, dia, upstroke_duration = truncatevecs(
+        [np.asarray(sbp), np.asarray(dia), np.asarray(upstroke_duration)],
+    )
+    index = series.index.to_numpy()
+    values = series.to_numpy()
+    first = index.searchsorted(sbp)
+    last = index.searchsorted(dia, "right") - 1
+    searchend = index.searchsorted(sbp + 2 * upstroke_duration, "right")
+    (valid,) = (last >= first).nonzero()
+    first, last, searchend = first[valid], last[valid], searchend[valid]
+    lengths = np.minimum(last + 1, searchend) - first
+
+    positions, offsets = gatherSegments(first, lengths)
+    # Signed distance of each sample to the chord (2D cross product)
+    x1 = np.repeat(sbp[valid].astype(np.float64), lengths)
+    y1 = np.repeat(values[first], lengths)
+    dx = dia[valid].astype(np.float64) - sbp[valid].astype(np.float64)
+    dx = np.repeat(dx, lengths)
+    dy = np.repeat(values[last], lengths) - y1
+    d = dx * (values[positions] - y1) - dy * (index[positions] - x1)
+    d /= np.sqrt(dx * dx + dy * dy)
+
+    argmin = argExtremum(d, offsets, offsets + lengths - 1, "min")
+    # Keep the systole when no distance could be computed
+    dics = np.where(argmin >= 0, positions[argmin], first)
+    return series.index[dics]
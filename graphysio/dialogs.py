@@ -6,16 +6,13 @@ from datetime import datetime
 from functools import partial
 from typing import Optional
 
-from pint import UnitRegistry
 from pint.errors import DimensionalityError, UndefinedUnitError
 from pyqtgraph.Qt import QtCore, QtGui, QtWidgets
 
 from graphysio import ui
 from graphysio.algorithms import filters
 from graphysio.structures import CycleId
-from graphysio.utils import sanitize_filepath
-
-ureg = UnitRegistry()
+from graphysio.utils import sanitize_filepath, unitRegistry
 
 
 class DlgCycleDetection(ui.Ui_CycleDetection, QtWidgets.QDialog):
@@ -385,13 +382,13 @@ class DlgSetDateTime(ui.Ui_SetDateTime, QtWidgets.QDialog):
 class DlgCurveAlgebra(QtWidgets.QDialog):
     dlgdata = QtCore.Signal(object)
 
-    def __init__(self, parent=None, curvecorr=None) -> None:
+    def __init__(self, parent=None, curvecorr=None, target=None) -> None:
         super().__init__(parent=parent)
         if curvecorr is None:
             curvecorr = {}
-        self.setupUi(curvecorr)
+        self.setupUi(curvecorr, target)
 
-    def setupUi(self, curvecorr) -> None:
+    def setupUi(self, curvecorr, target) -> None:
         vstack = QtWidgets.QVBoxLayout(self)
 
         self.lbl = QtWidgets.QLabel("Enter formula for new curve:")
@@ -404,6 +401,13 @@ class DlgCurveAlgebra(QtWidgets.QDialog):
         self.curveletters = QtWidgets.QLabel(curveslbl)
         vstack.addWidget(self.curveletters)
 
+        vstack.addWidget(QtWidgets.QLabel("Compute on the time grid of:"))
+        self.target = QtWidgets.QComboBox()
+        self.target.addItems(list(curvecorr.values()))
+        if target is not None:
+            self.target.setCurrentText(target)
+        vstack.addWidget(self.target)
+
         self.buttonbox = QtWidgets.QDialogButtonBox(
             QtWidgets.QDialogButtonBox.Ok | QtWidgets.QDialogButtonBox.Cancel,
         )
@@ -415,7 +419,7 @@ class DlgCurveAlgebra(QtWidgets.QDialog):
         self.setLayout(vstack)
 
     def accept(self) -> None:
-        result = self.formula.text()
+        result = (self.formula.text(), self.target.currentText())
         self.dlgdata.emit(result)
         super().accept()
 
@@ -471,6 +475,7 @@ def askUserValue(param):  # noqa: C901
             "Enter time",
             param.description,
         )
+        ureg = unitRegistry()
         try:
             value = ureg.Quantity(value)
             if value.dimensionless:
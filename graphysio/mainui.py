@@ -1,9 +1,11 @@
 import itertools
+import multiprocessing
 import os
 import sys
 import traceback
+from concurrent.futures import CancelledError
 from functools import partial
-from queue import Queue
+from queue import Empty, Queue
 from typing import Optional
 
 from pebble import ProcessPool
@@ -23,8 +25,13 @@ class MainUi(ui.Ui_MainWindow, QtWidgets.QMainWindow):
         self.dircache = os.path.expanduser("~")
 
         self.dataq = Queue()
-        self.pool = ProcessPool()
-        self.datahandler = self.createNewPlotWithData
+        self.progressq = multiprocessing.Queue()
+        self.pool = ProcessPool(
+            initializer=utils.setProgressQueue,
+            initargs=(self.progressq,),
+        )
+        # Futures of the tasks running on the pool with their label
+        self.tasks = {}
 
         self.tabWidget.tabCloseRequested.connect(self.closeTab)
         self.tabWidget.currentChanged.connect(self.tabChanged)
@@ -40,6 +47,8 @@ class MainUi(ui.Ui_MainWindow, QtWidgets.QMainWindow):
 
         self.menuFile.addSeparator()
         self.menuFile.addAction("&Load plugin", self.errguard(loadmodule))
+        self.menuFile.addAction("Purge file cache", self.purgeCache)
+        self.menuFile.addAction("Cancel background tasks", self.cancelTasks)
         self.menuFile.addSeparator()
         self.menuFile.addAction("&Quit", self.close, QtCore.Qt.CTRL | QtCore.Qt.Key_Q)
 
@@ -60,6 +69,10 @@ class MainUi(ui.Ui_MainWindow, QtWidgets.QMainWindow):
         self.pool.join()
         super().closeEvent(event)
 
+    def purgeCache(self) -> None:
+        readdata.cache.purge()
+        self.lblStatus.setText("File cache purged")
+
     def setCoords(self, x, y) -> None:
         if TimeAxisItem.is_relative_time(x):
             timestr = TimeAxisItem.conv_relative(x)
@@ -67,16 +80,76 @@ class MainUi(ui.Ui_MainWindow, QtWidgets.QMainWindow):
             timestr = TimeAxisItem.conv_absolute(x, mainwindow=True)
         self.lblCoords.setText(f"Time: {timestr}, Value: {y}")
 
+    def schedule(self, label, function, *args, handler) -> None:
+        """Run function(*args) on the pool and pass the result to handler.
+
+        The handler is called from the GUI thread through dataq.
+        """
+        future = self.pool.schedule(function, args=args)
+        self.tasks[future] = label
+
+        def cb(future) -> None:
+            try:
+                result = future.result()
+            except CancelledError:
+                return
+            except Exception as e:
+                self.dataq.put((self.reportTaskError, e))
+                return
+            self.dataq.put((handler, result))
+
+        future.add_done_callback(cb)
+        self.updateTaskStatus()
+
+    def cancelTasks(self) -> None:
+        for future in self.tasks:
+            future.cancel()
+        self.updateTaskStatus()
+
+    def reportTaskError(self, e) -> None:
+        traceback.print_exception(e, file=sys.stdout)
+        utils.displayError(e)
+
+    def updateTaskStatus(self, progress: Optional[str] = None) -> None:
+        if not self.tasks:
+            return
+        pending = [label for future, label in self.tasks.items() if not future.done()]
+        if not pending:
+            self.tasks = {}
+            self.lblStatus.setText("Background tasks... done")
+            return
+        ndone = len(self.tasks) - len(pending)
+        status = f"{pending[0]}... {ndone}/{len(self.tasks)} tasks done"
+        if progress is not None:
+            status += f" ({progress})"
+        self.lblStatus.setText(status)
+
     def read_plot_data(self) -> None:
+        progress = None
+        while True:
+            try:
+                label, fraction = self.progressq.get_nowait()
+            except Empty:
+                break
+            progress = f"{label}... {fraction:.0%}"
         while not self.dataq.empty():
-            data = self.dataq.get()
-            # Plotdata can be an object or a list of objects
+            handler, data = self.dataq.get()
             try:
-                iter(data)
-            except TypeError:
-                data = [data]
-            for plotdata in data:
-                self.datahandler(plotdata)
+                handler(data)
+            except Exception as e:
+                self.print_exception(e)
+        self.updateTaskStatus(progress)
+
+    def handlePlotData(self, datahandler, plotdata) -> None:
+        if not plotdata:
+            return
+        # Plotdata can be an object or a list of objects
+        try:
+            iter(plotdata)
+        except TypeError:
+            plotdata = [plotdata]
+        for item in plotdata:
+            datahandler(item)
 
     def print_exception(self, e) -> None:
         traceback.print_exc(file=sys.stdout)
@@ -128,17 +201,8 @@ class MainUi(ui.Ui_MainWindow, QtWidgets.QMainWindow):
     def launchOpenDwc(self, datahandler) -> None:
         reader = readdata.DwcReader()
         reader.askUserInput()
-        self.lblStatus.setText("Loading DWC...")
-        future = self.pool.schedule(reader.get_plotdata)
-
-        def cb(future) -> None:
-            self.lblStatus.setText("Loading... done")
-            plotdata = future.result()
-            if plotdata:
-                self.dataq.put(plotdata)
-
-        self.datahandler = datahandler
-        future.add_done_callback(cb)
+        handler = partial(self.handlePlotData, datahandler)
+        self.schedule("Loading DWC", reader.get_plotdata, handler=handler)
 
     def launchOpenFile(self, datahandler, filepath=None) -> None:
         reader = readdata.FileReader()
@@ -146,17 +210,8 @@ class MainUi(ui.Ui_MainWindow, QtWidgets.QMainWindow):
             self.dircache = reader.load_file(filepath)
         else:
             self.dircache = reader.user_choose_file(self.dircache)
-        self.lblStatus.setText("Loading File...")
-        future = self.pool.schedule(reader.get_plotdata)
-
-        def cb(future) -> None:
-            self.lblStatus.setText("Loading... done")
-            plotdata = future.result()
-            if plotdata:
-                self.dataq.put(plotdata)
-
-        self.datahandler = datahandler
-        future.add_done_callback(cb)
+        handler = partial(self.handlePlotData, datahandler)
+        self.schedule("Loading File", reader.get_plotdata, handler=handler)
 
     def createNewPlotWithData(self, plotdata) -> None:
         properties = {"dircache": self.dircache}
@@ -1,32 +1,61 @@
+import contextlib
 from functools import partial
 from typing import Optional
 
 import numpy as np
 import pandas as pd
 import pyqtgraph as pg
-from physiocurve.pandas import ECG, Pressure
 from pyqtgraph.Qt import QtCore, QtGui
 
-from graphysio import utils
 from graphysio.algorithms import waveform
-from graphysio.structures import CycleId
+from graphysio.algorithms.derived import DerivedSignals
+from graphysio.plotwidgets import lod
+from graphysio.structures import ChannelBuffer, CycleId, Segments
 from graphysio.utils import estimateSampleRate
 
-
-class CurveItem(pg.PlotDataItem):
+# Curves with more samples are drawn from a min/max pyramid
+LOD_THRESHOLD = 200_000
+# Number of points drawn while the pyramid is being built
+PREVIEW_POINTS = 10_000
+
+
+def mean_duplicates(series: pd.Series) -> pd.Series:
+    """Average the values of equal timestamps of a sorted series."""
+    index = series.index.to_numpy()
+    isfirst = np.empty(len(index), dtype=bool)
+    isfirst[:1] = True
+    np.not_equal(index[1:], index[:-1], out=isfirst[1:])
+    starts = np.flatnonzero(isfirst)
+    if len(starts) == len(index):
+        return series
+    values = series.to_numpy()
+    counts = np.diff(np.append(starts, len(index)))
+    means = np.add.reduceat(values, starts, dtype=np.float64) / counts
+    dtype = np.result_type(values.dtype, np.float32)
+    return pd.Series(means.astype(dtype), index=index[starts], name=series.name)
+
+
+class CurveItem(DerivedSignals, pg.PlotDataItem):
     visible = QtCore.Signal()
     invisible = QtCore.Signal()
+    pyramidready = QtCore.Signal(object)
 
     def __init__(self, series, parent, pen=None) -> None:
         self.parent = parent
-        self.series = self.sanitize_data(series)
-        if self.series is None:
+        self.pyramid = None
+        self.pyramidpending = False
+        self.revision = 0
+        series = self.sanitize_data(series)
+        if series is None:
             msg = "Not enough data"
             raise ValueError(msg)
-        self.samplerate = estimateSampleRate(self.series)
+        self.buffer = ChannelBuffer(series)
+        self.series = self.buffer.series(series.name)
+        self.updateSampleRate()
         if pen is None:
             pen = QtGui.QColor(QtCore.Qt.black)
         super().__init__(name=series.name, pen=pen, antialias=True)
+        self.pyramidready.connect(self.setPyramid)
         self.render()
 
     def replace_data(self, newdata) -> None:
@@ -35,37 +64,140 @@ class CurveItem(pg.PlotDataItem):
             # XXX report error
             return
         self.clear()
-        self.series = newdata.rename(self.opts["name"])
-        self.samplerate = estimateSampleRate(self.series)
+        self.buffer = ChannelBuffer(newdata)
+        self.series = self.buffer.series(self.opts["name"])
+        self.invalidate()
+        self.updateSampleRate()
         self.render()
 
     def extend(self, newseries) -> None:
-        merged = pd.concat([self.series, newseries])
-        newdata = self.sanitize_data(merged)
-        if newdata is None:
-            # XXX report error
+        if newseries.hasnans:
+            newseries = newseries.dropna()
+        if len(newseries) < 1:
             return
-        self.series = newdata
+        if not newseries.index.is_monotonic_increasing:
+            newseries = newseries.sort_index()
+        index = self.series.index
+        if newseries.index[0] > index[-1]:
+            # Samples come after the tail, only dedupe them
+            pos = len(index)
+            merged = newseries
+        else:
+            # Merge the overlapping region only, earlier samples stay put
+            pos = index.searchsorted(newseries.index[0])
+            merged = pd.concat([self.series.iloc[pos:], newseries])
+            merged = merged.sort_index()
+        merged = mean_duplicates(merged)
+        self.buffer.write(pos, merged)
+        self.series = self.buffer.series(self.opts["name"])
+        self.invalidate()
+        self.render(pos)
+
+    def shift(self, offset) -> None:
+        """Move the curve in time by offset ns."""
+        self.buffer.shift(round(offset))
+        self.series = self.buffer.series(self.opts["name"])
+        self.invalidate()
         self.render()
 
-    def render(self) -> None:
-        self.setData(x=self.series.index.to_numpy(), y=self.series.to_numpy())
+    def invalidate(self) -> None:
+        # Derived signals hold the samples, timestamps and rate they were
+        # computed from, results still in flight check the revision.
+        self.derivedcache.discard(self)
+        self.revision += 1
+
+    def render(self, changedfrom: Optional[int] = None) -> None:
+        x = self.series.index.to_numpy()
+        y = self.series.to_numpy()
+        if len(x) <= LOD_THRESHOLD:
+            self.pyramid = None
+            self.setData(x=x, y=y)
+            return
+        if self.pyramid is not None and changedfrom is not None:
+            # Samples before changedfrom are the same, refresh the rest
+            self.pyramid.update(x, y, changedfrom)
+        if self.pyramid is not None and self.pyramid.covers(x, y):
+            self.updateLOD()
+            return
+        self.pyramid = None
+        if self.pyramidpending:
+            # The pyramid is built again for the current data once done
+            return
+        # Draw a preview while the pyramid is built in the background
+        step = len(x) // PREVIEW_POINTS
+        self.setData(x=x[::step], y=y[::step])
+        self.pyramidpending = True
+        future = lod.executor.submit(lod.MinMaxPyramid, x, y)
+        future.add_done_callback(partial(self.pyramidBuilt, self.revision))
+
+    def pyramidBuilt(self, revision, future) -> None:
+        # Executed in a worker thread, the signal is queued to the GUI thread
+        with contextlib.suppress(RuntimeError):
+            self.pyramidready.emit((revision, future.result()))
+
+    def setPyramid(self, result) -> None:
+        revision, pyramid = result
+        self.pyramidpending = False
+        if revision != self.revision:
+            # Data changed in the meantime
+            self.render()
+            return
+        self.pyramid = pyramid
+        self.updateLOD()
+
+    def updateLOD(self, xrange=None) -> None:
+        vb = self.getViewBox()
+        if vb is None:
+            npixels = PREVIEW_POINTS // 2
+        else:
+            if xrange is None:
+                xrange = vb.viewRange()[0]
+            npixels = max(int(vb.width()), 100)
+        x, y = self.pyramid.query(xrange, npixels)
+        self.setData(x=x, y=y)
+
+    def viewRangeChanged(self, vb=None, ranges=None, changed=None) -> None:
+        super().viewRangeChanged(vb, ranges, changed)
+        if self.pyramid is None or (changed is not None and not changed[0]):
+            return
+        xrange = ranges[0] if ranges is not None else None
+        self.updateLOD(xrange)
+
+    def updateSampleRate(self) -> None:
+        segments = Segments.from_index(self.series.index)
+        self.samplerate = estimateSampleRate(segments)
+        # The runs found on the way serve until the samples or rate change
+        self.derivedcache.put(self.cachekey("segments"), segments)
+
+    @property
+    def segments(self) -> Segments:
+        """Contiguous runs of samples, found once per revision."""
+        compute = partial(Segments.from_index, self.series.index, self.samplerate)
+        return self.cached(("segments",), compute)
 
     def set_samplerate(self, newsamplerate) -> None:
         self.samplerate = newsamplerate
+        self.invalidate()
 
     def rename(self, newname: str) -> None:
         self.opts["name"] = newname
-        self.series = self.series.rename(newname)
+        # The series is owned by the curve, no need to copy the samples
+        self.series.name = newname
 
     def sanitize_data(self, series: pd.Series) -> Optional[pd.Series]:
-        series = series.dropna()
-        series = series.sort_index()
+        if series.hasnans:
+            series = series.dropna()
         # Less than 2 points are not visible
         if len(series) < 2:
             return None
+        steps = np.diff(series.index.to_numpy())
+        if (steps > 0).all():
+            # Already sorted with unique timestamps, nothing to do
+            return series
+        if (steps < 0).any():
+            series = series.sort_index()
         # Make timestamp unique and use mean of values on duplicates
-        return series.groupby(level=0).mean()
+        return mean_duplicates(series)
 
 
 class POIItem(pg.ScatterPlotItem):
@@ -195,81 +327,31 @@ class CurveItemWithPOI(CurveItem):
     def addFeet(self, cycleid) -> None:
         if cycleid is CycleId.none:
             return
-        elif cycleid is CycleId.velocity:
-            starts, stops = waveform.findFlowCycles(self)
-            self.feetitem.indices["start"] = starts
-            self.feetitem.indices["stop"] = stops
-        elif cycleid is CycleId.foot:
-            foot = waveform.findPressureFeet(self)
-            self.feetitem.indices["start"] = foot
-        elif cycleid is CycleId.pressure:
-            if "start" not in self.feetitem.indices:
-                self.addFeet(CycleId.foot)
-            dia, sbp, dic = waveform.findPressureFull(self)
-            self.feetitem.indices["diastole"] = dia
-            self.feetitem.indices["systole"] = sbp
-            self.feetitem.indices["dicrotic"] = dic
-        elif cycleid is CycleId.rwave:
-            ecg = ECG(self.series)
-            self.feetitem.indices["rwave"] = ecg.idxrwave
-        elif cycleid is CycleId.ecg:
-            ecg = ECG(self.series)
-            self.feetitem.indices["start"] = ecg.idxpwave
-            self.feetitem.indices["qwave"] = ecg.idxqwave
-            self.feetitem.indices["rwave"] = ecg.idxrwave
-            self.feetitem.indices["swave"] = ecg.idxswave
-            self.feetitem.indices["twave"] = ecg.idxtwave
-        elif cycleid is CycleId.foottan:
-            p = Pressure(self.series)
-            self.feetitem.indices["start"] = p.idxtanfeet
-        elif cycleid is CycleId.pressurebis:
-            p = Pressure(self.series)
-            self.feetitem.indices["start"] = p.idxfeet
-            self.feetitem.indices["diastole"] = p.idxdia
-            self.feetitem.indices["systole"] = p.idxsys
-            self.feetitem.indices["dicrotic"] = p.idxdic
-        else:
-            raise ValueError(cycleid)
+        found = waveform.detectFeet(*self.detectionArgs(cycleid))
+        self.mergeFeet(found)
+
+    def shift(self, offset) -> None:
+        super().shift(offset)
+        # Points of interest are timestamps of the curve
+        indices = self.feetitem.indices
+        for key, idx in indices.items():
+            indices[key] = idx + round(offset)
+        self.feetitem.render()
+
+    def detectionArgs(self, cycleid):
+        # Arguments of waveform.detectFeet, cheap to send to a worker
+        index = self.series.index.to_numpy()
+        values = self.series.to_numpy()
+        feet = self.feetitem.indices
+        bounds = self.segments.bounds
+        return (index, values, self.samplerate, cycleid, feet, bounds)
+
+    def mergeFeet(self, found) -> None:
+        self.feetitem.indices.update(found)
         self.feetitem.render()
 
     def getCycleIndices(self, vrange=None):
-        s = self.series
-        clip = partial(utils.clip, vrange=vrange)
-        hasstarts = ("start" in self.feetitem.indices) and self.feetitem.indices[
-            "start"
-        ].size > 0
-        hasstops = ("stop" in self.feetitem.indices) and self.feetitem.indices[
-            "stop"
-        ].size > 0
-        if vrange:
-            xmin, xmax = vrange
-        else:
-            xmin = s.index[0]
-            xmax = s.index[-1]
-        if not hasstarts:
-            # We have no feet, treat the whole signal as one cycle
-            locs = s.index.get_indexer([xmin, xmax], method="nearest")
-            indices = s.index[locs]
-            begins, ends = (np.array([i]) for i in indices)
-        elif not hasstops:
-            # We have no stops, starts serve as stops for previous cycle
-            begins = clip(self.feetitem.indices["start"].values)
-            endloc = s.index.get_indexer([xmax], method="nearest")
-            end = s.index[endloc]
-            ends = np.append(begins[1:], end)
-        else:
-            # We have starts and stops, use them
-            begins = self.feetitem.indices["start"].values
-            ends = self.feetitem.indices["stop"].values
-            begins, ends = map(clip, [begins, ends])
-
-        # Handle the case where we start in the middle of a cycle
-        while ends[0] <= begins[0]:
-            ends = ends[1:]
-
-        begins, ends = utils.truncatevecs([begins, ends])
-        durations = ends - begins
-        return (begins, durations)
+        return waveform.cycleIndices(self.series.index, self.feetitem.indices, vrange)
 
     def getFeetPoints(self, feetname) -> Optional[pd.Series]:
         if feetname not in self.feetitem.indices:
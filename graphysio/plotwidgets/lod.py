@@ -0,0 +1,139 @@
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+# Samples per bin of the finest level and reduction factor between levels
+BINSIZE = 8
+FACTOR = 2
+# Stop adding levels when the coarsest one has less bins than this
+MINBINS = 1024
+
+# numpy releases the GIL for reductions, a thread is enough to keep the UI
+# responsive while a pyramid is being built.
+executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="lod")
+
+
+def samebuffer(a: np.ndarray, b: np.ndarray) -> bool:
+    return a.shape == b.shape and a.ctypes.data == b.ctypes.data
+
+
+class Level:
+    def __init__(self, binsize: int, x, ymin, ymax) -> None:
+        self.binsize = binsize
+        self.x = x
+        self.ymin = ymin
+        self.ymax = ymax
+
+    def __len__(self) -> int:
+        return len(self.x)
+
+
+class MinMaxPyramid:
+    """Multi-resolution min/max envelope of a curve.
+
+    Level k summarizes the curve in bins of BINSIZE * FACTOR**k samples,
+    each bin being drawn as a vertical segment between its extrema.
+    """
+
+    def __init__(self, x: np.ndarray, y: np.ndarray) -> None:
+        self.x = x
+        self.y = y
+        self.levels: List[Level] = []
+        self.update(x, y, 0)
+
+    def update(self, x: np.ndarray, y: np.ndarray, start: int) -> None:
+        """Take new samples into account from position start on.
+
+        Only the bins from the one containing start on are computed again,
+        so that appending k samples costs O(k) reductions.
+        """
+        self.x, self.y = x, y
+        binsize = BINSIZE
+        b = start // binsize
+        reduced = (x, y, y)
+        for k in itertools.count():
+            srcx, srcmin, srcmax = reduced
+            step = BINSIZE if k == 0 else FACTOR
+            starts = np.arange(b * step, len(srcx), step)
+            if k < len(self.levels):
+                level = self.levels[k]
+                n = min(b, len(level))
+            else:
+                level = Level(binsize, srcx[:0], srcmin[:0], srcmax[:0])
+                self.levels.append(level)
+                # A new level, and the ones above it, cover the whole curve
+                b = 0
+                n = 0
+                starts = np.arange(0, len(srcx), step)
+            if len(starts) > 0:
+                level.x = np.concatenate([level.x[:n], srcx[starts]])
+                level.ymin = np.concatenate(
+                    [level.ymin[:n], np.minimum.reduceat(srcmin, starts)],
+                )
+                level.ymax = np.concatenate(
+                    [level.ymax[:n], np.maximum.reduceat(srcmax, starts)],
+                )
+            else:
+                # The curve may have shrunk when duplicates were merged
+                level.x = level.x[:n]
+                level.ymin = level.ymin[:n]
+                level.ymax = level.ymax[:n]
+            if len(level) <= MINBINS:
+                break
+            reduced = (level.x, level.ymin, level.ymax)
+            binsize *= FACTOR
+            b //= FACTOR
+        del self.levels[k + 1 :]
+
+    def covers(self, x: np.ndarray, y: np.ndarray) -> bool:
+        # Whether the pyramid was built over these very buffers
+        return samebuffer(self.x, x) and samebuffer(self.y, y)
+
+    @staticmethod
+    def envelope(level: Level, b0: int, b1: int) -> Tuple[np.ndarray, np.ndarray]:
+        x = np.repeat(level.x[b0:b1], 2)
+        y = np.column_stack([level.ymin[b0:b1], level.ymax[b0:b1]]).ravel()
+        return (x, y)
+
+    def query(
+        self,
+        xrange: Optional[Tuple[float, float]],
+        npixels: int,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Return about 2 * npixels points to draw in xrange.
+
+        Samples are returned as is once there are few enough of them. The
+        parts outside of xrange are sketched with the coarsest level so
+        that the data bounds of the item stay the same.
+        """
+        n = len(self.x)
+        if xrange is None:
+            i0, i1 = 0, n
+        else:
+            xmin, xmax = xrange
+            i0 = max(np.searchsorted(self.x, xmin) - 1, 0)
+            i1 = min(np.searchsorted(self.x, xmax) + 1, n)
+
+        top = self.levels[-1]
+        t0 = i0 // top.binsize
+        t1 = min(-(-i1 // top.binsize), len(top))
+        before = self.envelope(top, 0, t0)
+        after = self.envelope(top, t1, len(top))
+        # Make sure the last sample belongs to the bounds
+        after = (np.append(after[0], self.x[-1]), np.append(after[1], self.y[-1]))
+
+        if i1 - i0 <= 2 * npixels:
+            visible = (self.x[i0:i1], self.y[i0:i1])
+        else:
+            for level in self.levels:
+                if (i1 - i0) / level.binsize <= npixels:
+                    break
+            b0 = i0 // level.binsize
+            b1 = -(-i1 // level.binsize)
+            visible = self.envelope(level, b0, b1)
+
+        x = np.concatenate([before[0], visible[0], after[0]])
+        y = np.concatenate([before[1], visible[1], after[1]])
+        return (x, y)
@@ -137,6 +137,12 @@ class PlotWidget(pg.PlotWidget):
         self.rebuildLegend()
         curve.invisible.emit()
 
+    def closeEvent(self, event) -> None:
+        # Signals derived from the curves go with them
+        for curve in set(self.curves.values()) | self.hiddencurves:
+            curve.derivedcache.discard(curve)
+        super().closeEvent(event)
+
     def rebuildLegend(self) -> None:
         self.legend.clear()
         for curve in self.curves.values():
@@ -6,8 +6,7 @@ import pyqtgraph as pg
 from pyqtgraph import QtWidgets
 
 from graphysio import ui
-from graphysio.algorithms.filters import savgol
-from graphysio.algorithms.waveform import findPOIGreedy
+from graphysio.algorithms.waveform import GreedyPOI, nearestLoc
 from graphysio.plotwidgets import PlotWidget
 from graphysio.structures import PlotData
 from graphysio.writedata import exporter
@@ -110,7 +109,6 @@ class POISelectorPlot(PlotWidget):
         self.setMenuEnabled(False)
         self.properties = properties if properties is not None else {}
 
-        self.__sndderiv = None
         self.fixvalue = FixIndex.disabled
 
         self.curve = self.addSeriesAsCurve(series)
@@ -119,6 +117,10 @@ class POISelectorPlot(PlotWidget):
             raise ValueError(msg)
         self.exporter = exporter.POIExporter(self, self.name)
 
+        # Clicks snap to local extrema through lookup tables
+        self.climber("min")
+        self.climber("max")
+
         pen = pg.mkPen("k", width=2)
         self.vLine = pg.InfiniteLine(angle=90, movable=False, pen=pen)
         self.addItem(self.vLine, ignoreBounds=True)
@@ -127,29 +129,32 @@ class POISelectorPlot(PlotWidget):
         self.scene().sigMouseClicked.connect(clicked)
 
     def fixpos(self, pos):
-        # Need to go through get_loc, otherwise strange things happen
-        xmin, xmax = self.vbrange
         if self.fixvalue is FixIndex.minimum:
-            s = self.curve.series.loc[xmin:xmax]
-            posprop = findPOIGreedy(s, pos, "min")
-            fixedposloc = s.index.get_loc(posprop, method="nearest")
+            climber = self.climber("min")
         elif self.fixvalue is FixIndex.maximum:
-            s = self.curve.series.loc[xmin:xmax]
-            posprop = findPOIGreedy(s, pos, "max")
-            fixedposloc = s.index.get_loc(posprop, method="nearest")
+            climber = self.climber("max")
         elif self.fixvalue is FixIndex.sndderiv:
-            s = self.sndderiv.loc[xmin:xmax]
-            posprop = findPOIGreedy(s, pos, "max")
-            fixedposloc = s.index.get_loc(posprop, method="nearest")
+            climber = self.climber("max", ("smoothsndderiv", 0.16, 2))
         else:
-            s = self.curve.series.loc[xmin:xmax]
-            fixedposloc = s.index.get_loc(pos, method="nearest")
-        return s.index[fixedposloc]
-
-    @property
-    def sndderiv(self):
-        if self.__sndderiv is None:
-            sndderiv = self.curve.series.diff().diff().iloc[1:]
-            sndderiv, _ = savgol(sndderiv, self.curve.samplerate, (0.16, 2))
-            self.__sndderiv = sndderiv.dropna()
-        return self.__sndderiv
+            climber = None
+        series = self.curve.series if climber is None else climber.series
+        index = series.index
+        # Only look for the point within the visible range
+        xmin, xmax = self.vbrange
+        lo = index.searchsorted(xmin)
+        hi = index.searchsorted(xmax, "right")
+        if hi <= lo:
+            lo, hi = 0, len(index)
+        loc = min(max(nearestLoc(index, pos), lo), hi - 1)
+        if climber is not None:
+            loc = climber.climb(loc, lo, hi)
+        return index[loc]
+
+    def climber(self, kind, source=None):
+        # Lookup tables live with the derived signals of the curve
+        if source is None:
+            series = self.curve.series
+        else:
+            series = self.curve.derived(*source)
+        compute = partial(GreedyPOI, series, kind)
+        return self.curve.cached(("climber", kind, source), compute)
@@ -1,4 +1,6 @@
 import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 import numpy as np
 import pandas as pd
@@ -6,13 +8,15 @@ import pyqtgraph as pg
 from pyqtgraph.Qt import QtCore, QtWidgets
 
 from graphysio import dialogs
+from graphysio.algorithms import spectral
+from graphysio.plotwidgets.plotwidget import TimeAxisItem
 from graphysio.structures import Parameter, PlotData
 
 
 class SpectrogramWidget(QtWidgets.QWidget):
-    def __init__(self, series, Fs, s_chunklen, parent=None) -> None:
+    def __init__(self, series, Fs, s_chunklen, parent=None, **kwargs) -> None:
         super().__init__(parent=parent)
-        self.spectro = SpectrogramPlotWidget(series, Fs, s_chunklen, parent)
+        self.spectro = SpectrogramPlotWidget(series, Fs, s_chunklen, parent, **kwargs)
         self.loslider = QtWidgets.QSlider()
         self.hislider = QtWidgets.QSlider()
         layout = QtWidgets.QHBoxLayout()
@@ -34,56 +38,78 @@ class SpectrogramWidget(QtWidgets.QWidget):
 
     @property
     def menu(self):
-        mplot = {"Extract SEF": self.spectro.launchSEFExtract}
-        return {"Plot": mplot}
+        mextract = {
+            "Spectral edge frequency": self.spectro.launchSEFExtract,
+            "Median frequency": self.spectro.launchMedianExtract,
+            "Band power ratios": self.spectro.launchBandsExtract,
+            "All spectral features": self.spectro.launchAllExtract,
+        }
+        return {"Extract": mextract}
+
+
+class SpectroTimeAxisItem(TimeAxisItem):
+    # The image is placed in seconds from initvalue (ns)
+    def __init__(self, initvalue, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.initvalue = initvalue
 
+    def tickStrings(self, values, scale, spacing):
+        values = [self.initvalue + 1e9 * value for value in values]
+        return super().tickStrings(values, scale, spacing)
 
-class SpectroTimeAxisItem(pg.AxisItem):
-    def __init__(self, initvalue, samplerate, chunksize, *args, **kwargs) -> None:
-        super().__init__(*args, **kwargs)
-        self.initvalue = initvalue / 1e6  # ns to ms
-        self.samplerate = samplerate
-        self.chunksize = chunksize
-
-    def tickStrings(self, values, _scale, _spacing):
-        ret = []
-        value_to_time = self.chunksize / self.samplerate + self.initvalue
-        for value in values:
-            value = 1e3 * value  # s to ms
-            value = value * value_to_time
-            date = QtCore.QDateTime.fromMSecsSinceEpoch(value)
-            date = date.toTimeSpec(QtCore.Qt.UTC)
-            datestr = date.toString("dd/MM/yyyy\nhh:mm:ss.zzz")
-            ret.append(datestr)
-        return ret
+
+# numpy releases the GIL in FFTs, tiles are refined in a background thread
+executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="spectro")
 
 
 # To set:
 # levels
 # color gradient
 class SpectrogramPlotWidget(pg.PlotWidget):
-    def __init__(self, series, Fs, s_chunklen, parent=None) -> None:
-        # s_chunklen in seconds
+    tileready = QtCore.Signal(object)
+
+    def __init__(
+        self,
+        series,
+        Fs,
+        s_chunklen,
+        parent=None,
+        overlap=0,
+        window="hann",
+        naverage=1,
+    ) -> None:
+        # s_chunklen in seconds, overlap in percent of the window
         self.name = series.name
         self.parent = parent
-        self.origidx = series.index.values
+        self.series = series
+        self.initvalue = series.index[0]
 
         self.fs = Fs
-        self.data = series.values
         self.chunksize = int(s_chunklen * Fs)
-        self.win = np.hanning(self.chunksize)
+        # Views of the curve samples are a stable snapshot: its buffer never
+        # rewrites samples it handed out, see ChannelBuffer.
+        self.tiles = spectral.SpectrogramTiles(
+            series.index,
+            series.to_numpy(),
+            Fs,
+            self.chunksize,
+            int(self.chunksize * overlap / 100),
+            window,
+            naverage,
+        )
+        if self.tiles.ncols(0) < 1:
+            msg = "Signal shorter than the spectrogram window"
+            raise ValueError(msg)
+        # Tile images shown and tiles being computed
+        self.images = {}
+        self.pending = {}
 
         axisItem = SpectroTimeAxisItem(
-            initvalue=self.origidx[0],
-            samplerate=self.fs,
-            chunksize=self.chunksize,
+            initvalue=self.initvalue,
             orientation="bottom",
         )
         axisItems = {"bottom": axisItem}
         super().__init__(parent=self.parent, axisItems=axisItems)
-
-        self.img = pg.ImageItem()
-        self.addItem(self.img)
         self.setLabel("left", "Frequency", units="Hz")
 
         # bipolar colormap
@@ -99,62 +125,117 @@ class SpectrogramPlotWidget(pg.PlotWidget):
             dtype=np.ubyte,
         )
         cmap = pg.ColorMap(pos, color)
-        lut = cmap.getLookupTable(0.0, 1.0, 256)
-        self.img.setLookupTable(lut)
+        self.lut = cmap.getLookupTable(0.0, 1.0, 256)
 
-        self.calculate_psd()
+        self.tileready.connect(self.addTile)
+        self.getViewBox().sigRangeChanged.connect(self.refine)
         self.render()
 
-    def idx_to_hz(self, idxval):
-        conv = self.fs / self.chunksize
-        return conv * idxval
-
-    def calcsef(self, perc):
-        buf = np.zeros(self.psd.shape[0])
-        psdcs = np.cumsum(self.psd, axis=1)
-        for i, columncs in enumerate(psdcs):
-            thres = perc * columncs[-1] / 100
-            sefidx = np.where(columncs > thres)
-            with contextlib.suppress(IndexError):
-                buf[i] = self.idx_to_hz(sefidx[0][0])
-        return buf
-
-    def calculate_psd(self) -> None:
-        nsplit = int(len(self.data) / self.chunksize)
-        chunks = self.data[0 : nsplit * self.chunksize]
-        chunks = np.split(chunks, nsplit)
-        chunks = np.vstack(chunks)
-        spec = np.fft.rfft(chunks * self.win) / self.chunksize
-        self.psd = np.real(spec) ** 2
-
-    def genIndex(self):
-        nwindows = self.psd.shape[0]
-        winsize = self.chunksize
-        windows = np.lib.stride_tricks.as_strided(
-            self.origidx,
-            shape=(nwindows, winsize),
-        )
-        result = np.apply_along_axis(np.mean, 1, windows)
-        return result.astype(int)
-
     def launchSEFExtract(self) -> None:
         q = Parameter("SEF percentage", int)
         sefperc = dialogs.askUserValue(q)
         if not sefperc:
             return
-        curvename = f"{self.name}-sef{sefperc}"
-        sef = self.calcsef(sefperc)
-        sefseries = pd.Series(sef, index=self.genIndex(), name=curvename)
-        data = {curvename: sefseries}
-        plotdata = PlotData(data, name=curvename)
+        self.extract({f"sef{sefperc}": sefperc}, {})
+
+    def launchMedianExtract(self) -> None:
+        self.extract({"mf": 50}, {})
+
+    def launchBandsExtract(self) -> None:
+        self.extract({}, spectral.bands)
+
+    def launchAllExtract(self) -> None:
+        self.extract({"mf": 50, "sef90": 90, "sef95": 95}, spectral.bands)
+
+    def extract(self, edges, bands) -> None:
+        self.parent.schedule(
+            f"Extracting from {self.name}",
+            spectral.extract,
+            self.tiles,
+            edges,
+            bands,
+            handler=self.extracted,
+        )
+
+    def extracted(self, result) -> None:
+        times, features = result
+        data = {}
+        for feature, values in features.items():
+            curvename = f"{self.name}-{feature}"
+            data[curvename] = pd.Series(values, index=times, name=curvename)
+        plotname = f"{self.name}-{'-'.join(features)}"
+        plotdata = PlotData(data, name=plotname)
         self.parent.createNewPlotWithData(plotdata)
 
     def render(self) -> None:
+        # The coarsest level is shown at once and sets the color levels
+        top = self.tiles.toplevel
+        overview = self.tiles.get((top, 0))
         # TODO make lo / hi adjustable
-        psdnona = self.psd[~np.isnan(self.psd)]
+        psdnona = overview.psd[~np.isnan(overview.psd)]
         hi = np.percentile(psdnona, 95)
         lo = np.percentile(psdnona, 5)
-        # print(f'PSD Lo: {lo}, Hi: {hi}')
-        self.img.scale(1, self.fs / self.chunksize)
-        self.img.setLevels([lo, hi])
-        self.img.setImage(self.psd, autoLevels=False)
+        self.levels = [lo, hi]
+        self.addTile(((top, 0), overview))
+        self.refine()
+
+    def wantedTiles(self):
+        # Visible tiles at the resolution of the screen
+        vb = self.getViewBox()
+        (xmin, xmax), _ = vb.viewRange()
+        tmin, tmax = (self.initvalue + 1e9 * x for x in (xmin, xmax))
+        start, stop = self.series.index.searchsorted([tmin, tmax])
+        level = self.tiles.level((stop - start) / max(vb.width(), 1))
+        return set(self.tiles.visible(level, start, stop))
+
+    def refine(self, *args) -> None:
+        """Compute the tiles coming into view and drop the others."""
+        wanted = self.wantedTiles()
+        for key in self.tiles.evict(wanted):
+            self.removeItem(self.images.pop(key))
+        for key, future in list(self.pending.items()):
+            if key not in wanted and future.cancel():
+                del self.pending[key]
+        for key in wanted:
+            if key in self.images or key in self.pending:
+                continue
+            future = executor.submit(self.tiles.compute, *key)
+            future.add_done_callback(partial(self.tileComputed, key))
+            self.pending[key] = future
+
+    def tileComputed(self, key, future) -> None:
+        # Called from the worker thread, the tile is added in the GUI thread
+        if future.cancelled() or future.exception() is not None:
+            return
+        # The widget may have been closed in the meantime
+        with contextlib.suppress(RuntimeError):
+            self.tileready.emit((key, future.result()))
+
+    def addTile(self, result) -> None:
+        key, tile = result
+        self.pending.pop(key, None)
+        level, _ = key
+        if key in self.images:
+            return
+        if level != self.tiles.toplevel and key not in self.wantedTiles():
+            # Out of view by now
+            return
+        self.tiles.tiles[key] = tile
+        img = pg.ImageItem()
+        img.setLookupTable(self.lut)
+        img.setImage(tile.psd, autoLevels=False)
+        img.setLevels(self.levels)
+        img.setRect(self.imageRect(tile, level))
+        # Finer levels are drawn over the coarser ones
+        img.setZValue(self.tiles.toplevel - level)
+        self.addItem(img)
+        self.images[key] = img
+
+    def imageRect(self, tile, level) -> QtCore.QRectF:
+        # Columns and frequency bins are centered on their coordinates
+        times = (tile.times - self.initvalue) * 1e-9
+        freqs = tile.freqs
+        dt = self.tiles.colstep(level) / self.fs
+        df = freqs[1] - freqs[0]
+        x, y = times[0] - dt / 2, freqs[0] - df / 2
+        return QtCore.QRectF(x, y, dt * len(times), df * len(freqs))
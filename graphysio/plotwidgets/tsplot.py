@@ -1,12 +1,11 @@
 import string
 from functools import partial
 
-import numexpr as ne
 import pandas as pd
 from pyqtgraph.Qt import QtCore, QtWidgets
 
-from graphysio import dialogs, transformations
-from graphysio.algorithms import filters
+from graphysio import dialogs, transformations, utils
+from graphysio.algorithms import algebra, filters, spectral, waveform
 from graphysio.plotwidgets import (
     LoopWidget,
     PlotWidget,
@@ -26,11 +25,36 @@ class TSWidget(PlotWidget):
         self.appendData(plotdata)
 
     def filterCurve(self, oldcurve, filtername, asnew=False) -> None:
-        newseries, newsamplerate = filters.filter(
-            oldcurve,
-            filtername,
-            dialogs.askUserValue,
+        try:
+            name, parameters = filters.filter_parameters(
+                filtername,
+                dialogs.askUserValue,
+            )
+        except ValueError as e:
+            utils.displayError(e)
+            return
+        # Filtered signals are kept with the other derived signals
+        key = oldcurve.cachekey("filter", name, tuple(parameters))
+        handler = partial(self.curveFiltered, oldcurve, asnew, key, oldcurve.revision)
+        result = oldcurve.derivedcache.get(key)
+        if result is not None:
+            handler(result)
+            return
+        self.parent.schedule(
+            f"Filtering {oldcurve.name()}",
+            filters.apply_filter,
+            oldcurve.series,
+            oldcurve.samplerate,
+            name,
+            parameters,
+            oldcurve.segments,
+            handler=handler,
         )
+
+    def curveFiltered(self, oldcurve, asnew, key, revision, result) -> None:
+        if oldcurve.revision == revision:
+            oldcurve.derivedcache.put(key, result)
+        newseries, newsamplerate = result
         if asnew:
             newname = self.validateNewCurveName(newseries.name)
             if newname != newseries.name:
@@ -89,8 +113,16 @@ class TSWidget(PlotWidget):
 
         def cb(choices) -> None:
             for curvename, choice in choices.items():
+                cycleid = CycleId(choice)
+                if cycleid is CycleId.none:
+                    continue
                 curve = self.curves[curvename]
-                curve.addFeet(CycleId(choice))
+                self.parent.schedule(
+                    f"Detecting cycles of {curvename}",
+                    waveform.detectFeet,
+                    *curve.detectionArgs(cycleid),
+                    handler=curve.mergeFeet,
+                )
 
         dlgCycles.dlgdata.connect(cb)
         dlgCycles.exec()
@@ -126,8 +158,7 @@ class TSWidget(PlotWidget):
             return
         offset = newtimestamp - curtimestamp
         for curve in self.curves.values():
-            curve.series.index += offset
-            curve.render()
+            curve.shift(offset)
 
     def launchTransformation(self) -> None:
         param = Parameter(
@@ -163,45 +194,63 @@ class TSWidget(PlotWidget):
         curvename = dialogs.askUserValue(q)
         q = Parameter("Enter time window", "time")
         window = dialogs.askUserValue(q)
-        if not curvename:
+        if not curvename or not window:
+            return
+        q = Parameter("Window overlap (%)", int)
+        overlap = dialogs.askUserValue(q) or 0
+        q = Parameter("Window type", spectral.windowtypes)
+        windowtype = dialogs.askUserValue(q)
+        if windowtype is None:
             return
         curve = self.curves[curvename]
-        spectro = SpectrogramWidget(
-            curve.series,
-            curve.samplerate,
-            window,
-            parent=self.parent,
-        )
+        try:
+            spectro = SpectrogramWidget(
+                curve.series,
+                curve.samplerate,
+                window,
+                parent=self.parent,
+                overlap=min(max(overlap, 0), 99),
+                window=windowtype,
+            )
+        except ValueError as e:
+            utils.displayError(e)
+            return
         self.parent.addTab(spectro, curve.name())
 
     def launchCurveAlgebra(self) -> None:
         curvecorr = dict(zip(string.ascii_lowercase, self.curves.keys()))
-        dlgCurveAlgebra = dialogs.DlgCurveAlgebra(self, curvecorr)
+        # The fastest curve gives the default time grid
+        fastest = max(self.curves.values(), key=lambda c: c.samplerate, default=None)
+        target = fastest.name() if fastest is not None else None
+        dlgCurveAlgebra = dialogs.DlgCurveAlgebra(self, curvecorr, target)
 
-        def cb(formula) -> None:
-            symbols = list(ne.NumExpr(formula).input_names)
-            curvenames = [curvecorr[x] for x in symbols]
-            sers = [self.curves[c].series for c in curvenames]
-            if not len(sers):
+        def cb(result) -> None:
+            formula, targetname = result
+            expression = algebra.compiled(formula)
+            sources = {x: self.curves[curvecorr[x]].series for x in expression.names}
+            if not sources or targetname not in self.curves:
                 return
-
-            argsdf = pd.concat(sers, axis=1, keys=symbols)
-            argsdf = argsdf.interpolate()
-            args = argsdf.to_dict(orient="series")
-
-            newvals = ne.evaluate(formula, local_dict=args)
-            newname = self.validateNewCurveName(formula, True)
-            newseries = pd.Series(
-                newvals,
-                index=argsdf.index,
-                name=newname,
-                dtype="float64",
+            # The result gets its own samples, not a view of the target curve
+            times = self.curves[targetname].series.index.to_numpy(copy=True)
+            self.parent.schedule(
+                "Curve algebra",
+                algebra.curve_algebra,
+                formula,
+                sources,
+                times,
+                handler=partial(self.curveAlgebraDone, formula, times),
             )
-            self.addSeriesAsCurve(newseries)
 
         dlgCurveAlgebra.dlgdata.connect(cb)
         dlgCurveAlgebra.exec()
 
+    def curveAlgebraDone(self, formula, times, newvals) -> None:
+        newname = self.validateNewCurveName(formula, True)
+        if newname is None:
+            return
+        newseries = pd.Series(newvals, index=times, name=newname, dtype="float64")
+        self.addSeriesAsCurve(newseries)
+
     # Menu Selection
     def launchNewPlotFromSelection(self) -> None:
         xmin, xmax = self.vbrange
@@ -1,3 +1,4 @@
+from graphysio import utils
 from graphysio.structures import PlotData
 
 
@@ -11,5 +12,8 @@ class BaseReader:
     def askUserInput(self) -> None:
         pass
 
+    def report_progress(self, fraction: float) -> None:
+        utils.reportProgress("Loading File", fraction)
+
     def __call__(self) -> PlotData:
         raise NotImplementedError
@@ -0,0 +1,152 @@
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+from dataclasses import asdict
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+from graphysio.structures import PlotData
+
+# Bump when the layout of cache entries changes
+CACHE_VERSION = 1
+# Maximum size of the cache on disk in bytes
+CACHE_MAXSIZE = 8 * 1024**3
+
+
+def cache_dir() -> Path:
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or Path.home() / "AppData" / "Local"
+        return Path(base, "GraPhysio", "Cache")
+    if sys.platform == "darwin":
+        return Path.home() / "Library" / "Caches" / "GraPhysio"
+    base = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(base, "graphysio")
+
+
+def cache_key(request) -> str:
+    filepath = Path(request.filepath).resolve()
+    stat = filepath.stat()
+    fields = asdict(request)
+    fields["filepath"] = str(filepath)
+    fields["mtime"] = stat.st_mtime_ns
+    fields["size"] = stat.st_size
+    fields["version"] = CACHE_VERSION
+    dump = json.dumps(fields, sort_keys=True, default=str)
+    return hashlib.sha256(dump.encode()).hexdigest()
+
+
+class CachedPlotData(PlotData):
+    """PlotData backed by memory-mapped files of a cache entry.
+
+    Only the location of the entry is pickled so that the data is mapped
+    again instead of being copied when sent to another process.
+    """
+
+    def __init__(self, entry: Path, n: int, filepath, name) -> None:
+        self.entry = entry
+        self.n = n
+        data = self.open_frame()
+        super().__init__(data, filepath=filepath, name=name)
+
+    def open_frame(self) -> pd.DataFrame:
+        index = np.load(self.entry / f"{self.n}-index.npy", mmap_mode="c")
+        values = np.load(self.entry / f"{self.n}-values.npy", mmap_mode="c")
+        columns = json.loads((self.entry / f"{self.n}-columns.json").read_text())
+        # Values are stored column-major so that no copy is needed here
+        return pd.DataFrame(values, index=index, columns=columns, copy=False)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["data"]
+        return state
+
+    def __setstate__(self, state) -> None:
+        self.__dict__.update(state)
+        self.data = self.open_frame()
+
+
+def load(key: str) -> Optional[List[PlotData]]:
+    entry = cache_dir() / key
+    try:
+        meta = json.loads((entry / "meta.json").read_text())
+        plotdata = [
+            CachedPlotData(entry, n, meta["filepath"], name)
+            for n, name in enumerate(meta["names"])
+        ]
+    except (OSError, ValueError, KeyError):
+        return None
+    # Keep track of the last use for LRU eviction
+    os.utime(entry)
+    return plotdata
+
+
+def store(key: str, plotdata: List[PlotData]) -> bool:
+    for item in plotdata:
+        dtypes = set(item.data.dtypes)
+        if len(dtypes) != 1 or not np.issubdtype(dtypes.pop(), np.number):
+            # Only homogeneous numeric frames can be mapped
+            return False
+    size = sum(item.data.index.nbytes + item.data.values.nbytes for item in plotdata)
+    if size > CACHE_MAXSIZE:
+        # It would only push everything else out before being evicted
+        return False
+
+    root = cache_dir()
+    try:
+        root.mkdir(parents=True, exist_ok=True)
+        tmpentry = Path(tempfile.mkdtemp(dir=root, prefix=".tmp-"))
+    except OSError:
+        return False
+    try:
+        for n, item in enumerate(plotdata):
+            index = item.data.index.to_numpy(dtype=np.int64)
+            values = np.asfortranarray(item.data.to_numpy())
+            np.save(tmpentry / f"{n}-index.npy", index)
+            np.save(tmpentry / f"{n}-values.npy", values)
+            columns = json.dumps([str(c) for c in item.data.columns])
+            (tmpentry / f"{n}-columns.json").write_text(columns)
+        meta = {
+            "filepath": str(plotdata[0].filepath),
+            "names": [item.name for item in plotdata],
+        }
+        (tmpentry / "meta.json").write_text(json.dumps(meta))
+        os.replace(tmpentry, root / key)
+    except OSError:
+        shutil.rmtree(tmpentry, ignore_errors=True)
+        return False
+    evict(CACHE_MAXSIZE, keep=key)
+    return True
+
+
+def entry_size(entry: Path) -> int:
+    return sum(f.stat().st_size for f in entry.iterdir())
+
+
+def evict(maxsize: int, keep: Optional[str] = None) -> None:
+    root = cache_dir()
+    try:
+        entries = [e for e in root.iterdir() if e.is_dir()]
+        # Least recently used first
+        entries.sort(key=lambda e: e.stat().st_mtime)
+        sizes = [entry_size(e) for e in entries]
+    except OSError:
+        return
+    total = sum(sizes)
+    for entry, size in zip(entries, sizes):
+        if total <= maxsize:
+            break
+        if entry.name == keep:
+            # Just stored, it has to survive its own eviction pass
+            continue
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
+
+
+def purge() -> None:
+    shutil.rmtree(cache_dir(), ignore_errors=True)
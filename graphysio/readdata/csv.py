@@ -1,16 +1,25 @@
 import csv
+import os
 from dataclasses import dataclass
 from functools import partial
 from pathlib import Path
 from typing import List
 
+import numpy as np
 import pandas as pd
 from pyqtgraph.Qt import QtCore, QtGui, QtWidgets
 
 from graphysio import ui
+from graphysio.readdata import cache
 from graphysio.readdata.baseclass import BaseReader
+from graphysio.readdata.timestamps import TimestampParser
 from graphysio.structures import PlotData
 
+# Number of CSV rows parsed at once
+CHUNKSIZE = 1_000_000
+# Files bigger than this (in bytes) are loaded as float32
+COMPACT_FILESIZE = 256 * 1024**2
+
 
 class CsvReader(BaseReader):
     is_available = True
@@ -25,69 +34,49 @@ class CsvReader(BaseReader):
 
     def __call__(self) -> List[PlotData]:
         request = self.userdata["csvrequest"]
-        data = pd.read_csv(
-            request.filepath,
-            sep=request.seperator,
-            usecols=request.fields,
-            decimal=request.decimal,
-            skiprows=request.droplines,
-            encoding=request.encoding,
-            index_col=False,
-            engine="c",
+        key = cache.cache_key(request)
+        plotdata = cache.load(key)
+        if plotdata is not None:
+            return plotdata
+
+        filesize = os.path.getsize(request.filepath)
+        # Big files are stored as float32 to keep memory usage in check
+        valuetype = np.float32 if filesize > COMPACT_FILESIZE else np.float64
+
+        parse_timestamps = TimestampParser(
+            request.datetime_format,
+            request.timezone,
+            key=(request.filepath, request.dtfield),
         )
-        pdtonum = partial(pd.to_numeric, errors="coerce")
-        dtformat = request.datetime_format
-        if request.generatex:
-            data.index = (1e9 * data.index / request.samplerate).astype("int")
-            # Make all data numeric and remove empty rows
-            datacols = data.columns.difference([request.clusterid])
-            data[datacols] = data[datacols].apply(pdtonum)
-            data = data.dropna(axis="rows", how="all", subset=datacols)
-        else:
-            timestamp = data[request.dtfield]
-            data = data.drop(columns=request.dtfield)
-            # Force all columns to numeric
-            datacols = data.columns.difference([request.clusterid])
-            data[datacols] = data[datacols].apply(pdtonum)
-            # data = data.dropna(axis="rows", how="all", subset=datacols)
-            nanrows = data[datacols].isna().all(axis=1)
-            data = data[~nanrows]
-            timestamp = timestamp[~nanrows]
-
-            if dtformat == "<hours>":
-                timestamp = pdtonum(timestamp)
-                timestamp = pd.to_datetime(timestamp * 3.6e12, unit="ns")
-            elif dtformat == "<minutes>":
-                timestamp = pdtonum(timestamp)
-                timestamp = pd.to_datetime(timestamp * 6e10, unit="ns")
-            elif dtformat == "<seconds>":
-                timestamp = pdtonum(timestamp)
-                timestamp = pd.to_datetime(timestamp * 1e9, unit="ns")
-            elif dtformat == "<milliseconds>":
-                timestamp = pdtonum(timestamp)
-                timestamp = pd.to_datetime(timestamp * 1e6, unit="ns")
-            elif dtformat == "<microseconds>":
-                timestamp = pdtonum(timestamp)
-                timestamp = pd.to_datetime(timestamp * 1e3, unit="ns")
-            elif dtformat == "<nanoseconds>":
-                timestamp = pdtonum(timestamp)
-                timestamp = pd.to_datetime(timestamp, unit="ns")
-            else:
-                if dtformat == "<infer>":
-                    opts = {"infer_datetime_format": True}
-                else:
-                    opts = {"format": dtformat}
-                timestamp = pd.to_datetime(timestamp, **opts)
-                timestamp = pd.Index(timestamp)
-                if timestamp.tz is None:
-                    timestamp = timestamp.tz_localize(request.timezone)
-                timestamp = timestamp.tz_convert("UTC").tz_localize(None)
-
-            timestamp = timestamp.astype("datetime64[ns]").astype("int")
-            data = data.set_index([timestamp])
-
-        data = data.dropna(axis="columns", how="all")
-        data = data.sort_index()
+        chunks = []
+        nonempty = set()
+        with open(request.filepath, "rb") as csvfile:
+            reader = pd.read_csv(
+                csvfile,
+                sep=request.seperator,
+                usecols=request.fields,
+                decimal=request.decimal,
+                skiprows=request.droplines,
+                encoding=request.encoding,
+                index_col=False,
+                engine="c",
+                chunksize=CHUNKSIZE,
+            )
+            for chunk in reader:
+                chunk = self.parse_chunk(chunk, request, valuetype, parse_timestamps)
+                nonempty.update(chunk.columns[chunk.notna().any()])
+                chunks.append(chunk)
+                self.report_progress(csvfile.tell() / filesize)
+
+        if not chunks:
+            return []
+        data = pd.concat(chunks) if len(chunks) > 1 else chunks[0]
+        del chunks
+        emptycols = data.columns.difference(nonempty)
+        if len(emptycols) > 0:
+            data = data.drop(columns=emptycols)
+        if not data.index.is_monotonic_increasing:
+            data = data.sort_index()
 
         fp = request.filepath
         if request.clusterid:
@@ -103,8 +92,28 @@ class CsvReader(BaseReader):
         else:
             plotdata = [PlotData(data=data, filepath=fp)]
 
+        if plotdata and cache.store(key, plotdata):
+            # Hand over the memory-mapped copy instead
+            plotdata = cache.load(key) or plotdata
         return plotdata
 
+    @staticmethod
+    def parse_chunk(data, request, valuetype, parse_timestamps) -> pd.DataFrame:
+        pdtonum = partial(pd.to_numeric, errors="coerce")
+        # Make all data numeric and remove empty rows
+        datacols = data.columns.difference([request.clusterid, request.dtfield])
+        data[datacols] = data[datacols].apply(pdtonum).astype(valuetype)
+        nanrows = data[datacols].isna().all(axis=1)
+        data = data[~nanrows]
+
+        if request.generatex:
+            timestamp = 1e9 * data.index / request.samplerate
+        else:
+            timestamp = parse_timestamps(data[request.dtfield])
+            data = data.drop(columns=request.dtfield)
+
+        return data.set_index([np.asarray(timestamp, dtype=np.int64)])
+
 
 @dataclass
 class CsvRequest:
@@ -0,0 +1,213 @@
+import re
+from functools import partial
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Multiplier to convert numeric timestamps to nanoseconds
+numeric_units = {
+    "<hours>": 3.6e12,
+    "<minutes>": 6e10,
+    "<seconds>": 1e9,
+    "<milliseconds>": 1e6,
+    "<microseconds>": 1e3,
+    "<nanoseconds>": 1,
+}
+
+# strptime directives understood by the fast path with their width
+fixed_directives = {"Y": 4, "m": 2, "d": 2, "H": 2, "M": 2, "S": 2}
+
+iso_regex = re.compile(
+    r"^\d{4}-\d{2}-\d{2}(?P<sep>[T ])\d{2}:\d{2}"
+    r"(?P<sec>:\d{2})?(?:(?P<dec>[.,])(?P<frac>\d{1,9}))?$",
+)
+
+# Layouts detected per file, reused when the same file is opened again
+layout_cache: Dict[Tuple[str, str, str], "Layout"] = {}
+
+
+class Layout:
+    """Positions of the date fields in a fixed-width timestamp string."""
+
+    def __init__(self, dtformat: str, width: int) -> None:
+        self.dtformat = dtformat
+        self.width = width
+        self.fields: Dict[str, Tuple[int, int]] = {}
+        self.literals: List[Tuple[int, int]] = []
+
+    @classmethod
+    def from_format(cls, dtformat: str, width: int) -> Optional["Layout"]:
+        layout = cls(dtformat, width)
+        # Width of all fields except fractional seconds
+        fixed = len(re.sub(r"%.", "", dtformat)) + sum(
+            fixed_directives.get(d, 0) for d in re.findall(r"%(.)", dtformat)
+        )
+        pos = 0
+        i = 0
+        while i < len(dtformat):
+            char = dtformat[i]
+            if char != "%":
+                layout.literals.append((pos, ord(char)))
+                pos += 1
+                i += 1
+                continue
+            try:
+                directive = dtformat[i + 1]
+            except IndexError:
+                return None
+            if directive in fixed_directives:
+                fieldwidth = fixed_directives[directive]
+            elif directive == "f":
+                fieldwidth = width - fixed
+                if not 0 < fieldwidth <= 9:
+                    return None
+            else:
+                # Directive not handled by the fast path
+                return None
+            if directive in layout.fields:
+                return None
+            layout.fields[directive] = (pos, fieldwidth)
+            pos += fieldwidth
+            i += 2
+        if pos != width or not {"Y", "m", "d"} <= set(layout.fields):
+            return None
+        return layout
+
+    @classmethod
+    def infer(cls, sample: str) -> Optional["Layout"]:
+        match = iso_regex.match(sample)
+        if match is None:
+            return None
+        dtformat = f"%Y-%m-%d{match['sep']}%H:%M"
+        if match["sec"]:
+            dtformat += ":%S"
+            if match["frac"]:
+                dtformat += f"{match['dec']}%f"
+        elif match["frac"]:
+            return None
+        return cls.from_format(dtformat, len(sample))
+
+    def parse(self, strings: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Return naive nanosecond timestamps and a mask of parsed rows."""
+        n = len(strings)
+        # One extra byte to detect strings that are too long
+        try:
+            raw = strings.astype(f"S{self.width + 1}")
+        except (UnicodeEncodeError, ValueError, TypeError):
+            return (np.zeros(n, dtype=np.int64), np.zeros(n, dtype=bool))
+        buf = raw.view(np.uint8).reshape(n, self.width + 1)
+        digits = buf - np.uint8(ord("0"))
+
+        valid = buf[:, self.width] == 0
+        for pos, char in self.literals:
+            valid &= buf[:, pos] == char
+        for pos, fieldwidth in self.fields.values():
+            for col in range(pos, pos + fieldwidth):
+                valid &= digits[:, col] < 10
+
+        def field(name, default=0):
+            try:
+                pos, fieldwidth = self.fields[name]
+            except KeyError:
+                return np.full(n, default, dtype=np.int64)
+            value = digits[:, pos].astype(np.int64)
+            for col in range(pos + 1, pos + fieldwidth):
+                value *= 10
+                value += digits[:, col]
+            return value
+
+        year = field("Y")
+        month = field("m", 1)
+        day = field("d", 1)
+        hour = field("H")
+        minute = field("M")
+        second = field("S")
+        frac = field("f")
+        if "f" in self.fields:
+            _, fracwidth = self.fields["f"]
+            frac *= 10 ** (9 - fracwidth)
+
+        leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+        monthdays = np.array([0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+        valid &= (month >= 1) & (month <= 12)
+        maxday = monthdays[np.clip(month, 0, 12)] + (leap & (month == 2))
+        valid &= (day >= 1) & (day <= maxday)
+        valid &= (hour < 24) & (minute < 60) & (second < 60)
+
+        ns = days_from_civil(year, month, day)
+        ns = ((ns * 24 + hour) * 60 + minute) * 60 + second
+        ns = ns * 1_000_000_000 + frac
+        return (ns, valid)
+
+
+def days_from_civil(year, month, day):
+    # Days since 1970-01-01 in the proleptic Gregorian calendar (H. Hinnant)
+    year = year - (month <= 2)
+    era = year // 400
+    yoe = year - era * 400
+    doy = (153 * (month + np.where(month > 2, -3, 9)) + 2) // 5 + day - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 719468
+
+
+class TimestampParser:
+    """Convert a column of timestamps to UTC nanoseconds.
+
+    Fixed-width layouts are parsed with vectorized numpy operations, the
+    layout being detected once per file. Rows which do not fit the layout
+    are handed over to pandas.
+    """
+
+    def __init__(self, dtformat: str, timezone: str, key=None) -> None:
+        self.dtformat = dtformat
+        self.timezone = timezone
+        self.key = None if key is None else (str(key), dtformat, timezone)
+        self.layout = layout_cache.get(self.key)
+        self.detected = self.layout is not None
+
+    def __call__(self, timestamp: pd.Series) -> np.ndarray:
+        if self.dtformat in numeric_units:
+            pdtonum = partial(pd.to_numeric, errors="coerce")
+            timestamp = pdtonum(timestamp) * numeric_units[self.dtformat]
+            timestamp = pd.to_datetime(timestamp, unit="ns")
+            return timestamp.astype("datetime64[ns]").astype("int64").to_numpy()
+
+        strings = timestamp.to_numpy(dtype=object)
+        if not self.detected:
+            self.detect(strings)
+        if self.layout is None:
+            return self.parse_pandas(timestamp)
+
+        ns, parsed = self.layout.parse(strings)
+        ns[parsed] = self.localize(ns[parsed])
+        if not parsed.all():
+            ns[~parsed] = self.parse_pandas(timestamp[~parsed])
+        return ns
+
+    def detect(self, strings: np.ndarray) -> None:
+        samples = [s for s in strings[:100] if isinstance(s, str)]
+        if samples:
+            sample = samples[0].strip()
+            if self.dtformat == "<infer>":
+                self.layout = Layout.infer(sample)
+            else:
+                self.layout = Layout.from_format(self.dtformat, len(sample))
+            self.detected = True
+        if self.key is not None and self.layout is not None:
+            layout_cache[self.key] = self.layout
+
+    def parse_pandas(self, timestamp: pd.Series) -> np.ndarray:
+        opts = {} if self.dtformat == "<infer>" else {"format": self.dtformat}
+        timestamp = pd.Index(pd.to_datetime(timestamp, **opts))
+        if timestamp.tz is None:
+            timestamp = timestamp.tz_localize(self.timezone)
+        timestamp = timestamp.tz_convert("UTC").tz_localize(None)
+        return timestamp.astype("datetime64[ns]").asi8
+
+    def localize(self, ns: np.ndarray) -> np.ndarray:
+        if self.timezone == "UTC" or len(ns) < 1:
+            return ns
+        timestamp = pd.DatetimeIndex(ns.view("datetime64[ns]"))
+        timestamp = timestamp.tz_localize(self.timezone).tz_convert("UTC")
+        return timestamp.tz_localize(None).asi8
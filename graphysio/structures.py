@@ -1,10 +1,18 @@
-from collections import namedtuple
+import tempfile
+from collections import OrderedDict, namedtuple
 from enum import Enum
 from pathlib import Path
 from typing import Optional
 
+import numpy as np
 import pandas as pd
 
+# Memory budget of the signals derived from all the curves, in bytes
+DERIVED_MAXSIZE = 512 * 1024**2
+
+# A time step longer than this many sample periods is a gap
+GAPFACTOR = 1.5
+
 Filter = namedtuple("Filter", ["name", "parameters"])
 Parameter = namedtuple("Parameter", ["description", "request"])
 
@@ -45,3 +53,251 @@ class PlotData:
     @property
     def folder(self):
         return self.filepath.parent
+
+
+def is_mapped(array) -> bool:
+    # Walk up the chain of views looking for a memory-mapped buffer
+    while isinstance(array, np.ndarray):
+        if isinstance(array, np.memmap):
+            return True
+        array = array.base
+    return False
+
+
+class ChannelStore:
+    """Keep channel samples in memory-mapped temporary files.
+
+    The samples live in the file system cache instead of the process heap,
+    and curves, filters and exporters work on views of the same mapping so
+    that several plots of one recording share a single physical copy.
+    """
+
+    def __init__(self, directory: Optional[Path] = None) -> None:
+        self.directory = directory
+
+    def allocate(self, n: int, dtype) -> np.ndarray:
+        dtype = np.dtype(dtype)
+        if n < 1:
+            return np.empty(0, dtype=dtype)
+        # The file is deleted on close, the mapping keeps it alive until
+        # the last view is released.
+        with tempfile.TemporaryFile(dir=self.directory) as fd:
+            fd.truncate(n * dtype.itemsize)
+            return np.memmap(fd, dtype=dtype, mode="r+", shape=(n,))
+
+    def store(self, array) -> np.ndarray:
+        array = np.asarray(array)
+        if is_mapped(array) or array.dtype == object:
+            return array
+        mapped = self.allocate(len(array), array.dtype)
+        mapped[:] = array
+        return mapped
+
+    def store_series(self, series: pd.Series) -> pd.Series:
+        index = self.store(series.index.to_numpy(dtype=np.int64))
+        values = self.store(series.to_numpy())
+        return pd.Series(
+            values,
+            index=pd.Index(index, copy=False),
+            name=series.name,
+            copy=False,
+        )
+
+
+channelstore = ChannelStore()
+
+
+class ChannelBuffer:
+    """Growable memory-mapped storage of the samples of one curve.
+
+    Capacity is doubled when needed so that appending k samples costs
+    amortized O(k). Samples handed out by series() may be viewed by other
+    curves, tiles or workers, so they are never written in place: appends go
+    to the spare capacity and anything else moves the samples to a new
+    mapping owned by this channel.
+    """
+
+    def __init__(self, series: pd.Series, store: ChannelStore = channelstore) -> None:
+        self.store = store
+        index = series.index.to_numpy(dtype=np.int64)
+        values = series.to_numpy()
+        self.index = store.store(index)
+        self.values = store.store(values)
+        # Writing to arrays we did not allocate could alter other curves
+        self.owned = self.index is not index and self.values is not values
+        self.n = len(series)
+
+    @property
+    def capacity(self) -> int:
+        return len(self.index)
+
+    def series(self, name=None) -> pd.Series:
+        return pd.Series(
+            self.values[: self.n],
+            index=pd.Index(self.index[: self.n], copy=False),
+            name=name,
+            copy=False,
+        )
+
+    def reserve(self, n: int, dtype, keep: Optional[int] = None) -> None:
+        """Make room for n samples, keeping the first keep ones in place.
+
+        The samples after keep are about to be replaced. If some of them were
+        already handed out, they are left to their viewers in the old mapping.
+        """
+        if keep is None:
+            keep = self.n
+        if (
+            self.owned
+            and keep >= self.n
+            and n <= self.capacity
+            and dtype == self.values.dtype
+        ):
+            return
+        capacity = max(n, 2 * self.capacity)
+        index = self.store.allocate(capacity, np.int64)
+        values = self.store.allocate(capacity, dtype)
+        keep = min(keep, self.n)
+        index[:keep] = self.index[:keep]
+        values[:keep] = self.values[:keep]
+        self.index, self.values = index, values
+        self.owned = True
+
+    def shift(self, offset: int) -> None:
+        """Move all the timestamps by offset ns, in a new mapping."""
+        index = self.store.allocate(self.capacity, np.int64)
+        np.add(self.index[: self.n], offset, out=index[: self.n])
+        self.index = index
+
+    def write(self, pos: int, series: pd.Series) -> None:
+        """Replace the samples from position pos on with series."""
+        n = pos + len(series)
+        dtype = np.result_type(self.values.dtype, series.dtype)
+        self.reserve(n, dtype, pos)
+        self.index[pos:n] = series.index.to_numpy(dtype=np.int64)
+        self.values[pos:n] = series.to_numpy()
+        self.n = n
+
+
+def nbytes(value) -> int:
+    if isinstance(value, (tuple, list)):
+        return sum(map(nbytes, value))
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage().sum())
+    if isinstance(value, (pd.Series, pd.Index)):
+        return int(value.memory_usage())
+    return int(getattr(value, "nbytes", 0))
+
+
+class DerivedCache:
+    """Signals derived from curves, keyed by (curve, revision, op, params).
+
+    Least recently used entries are evicted once the cache holds more than
+    maxbytes. Entries of an old revision are never hit again, owners discard
+    them when their samples change.
+    """
+
+    def __init__(self, maxbytes: int = DERIVED_MAXSIZE) -> None:
+        self.maxbytes = maxbytes
+        self.entries = OrderedDict()
+        self.size = 0
+
+    def __contains__(self, key) -> bool:
+        return key in self.entries
+
+    def get(self, key, compute=None):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            value, _ = self.entries[key]
+            return value
+        if compute is None:
+            return None
+        value = compute()
+        self.put(key, value)
+        return value
+
+    def put(self, key, value) -> None:
+        self.pop(key)
+        size = nbytes(value)
+        if size > self.maxbytes:
+            return
+        self.entries[key] = (value, size)
+        self.size += size
+        while self.size > self.maxbytes:
+            _, (_, evicted) = self.entries.popitem(last=False)
+            self.size -= evicted
+
+    def pop(self, key) -> None:
+        if key in self.entries:
+            _, size = self.entries.pop(key)
+            self.size -= size
+
+    def discard(self, owner) -> None:
+        """Drop the entries whose key starts with owner."""
+        for key in [key for key in self.entries if key[0] is owner]:
+            self.pop(key)
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.size = 0
+
+
+# One budget shared by all the curves
+derivedcache = DerivedCache()
+
+
+class Segments:
+    """Contiguous runs of samples of a time series, separated by gaps.
+
+    Runs are given as positions [start, stop) along with their own sample
+    rate, estimated from the timestamps of the run.
+    """
+
+    def __init__(self, bounds: np.ndarray, samplerates: np.ndarray, samplerate) -> None:
+        self.bounds = bounds
+        self.samplerates = samplerates
+        self.samplerate = samplerate
+
+    @classmethod
+    def from_index(cls, index, samplerate=None) -> "Segments":
+        index = np.asarray(index, dtype=np.int64)
+        n = len(index)
+        if n < 2:
+            rate = samplerate if samplerate is not None else 0
+            return cls(np.array([0, n]), np.array([rate], dtype=float), rate)
+        steps = np.diff(index)
+        period = np.median(steps) if samplerate is None else 1e9 / samplerate
+        isgap = steps > GAPFACTOR * period
+        (gaps,) = isgap.nonzero()
+        bounds = np.concatenate([[0], gaps + 1, [n]])
+        if samplerate is None:
+            samplerate = 1e9 / np.median(steps[~isgap])
+
+        starts, stops = bounds[:-1], bounds[1:]
+        lengths = stops - starts
+        durations = index[stops - 1] - index[starts]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            samplerates = 1e9 * (lengths - 1) / durations
+        # Rounded as the overall rate estimated for curves
+        samplerates = np.where(samplerates > 1, np.round(samplerates), samplerates)
+        # Single samples have no rate of their own
+        samplerates[lengths < 2] = samplerate
+        return cls(bounds, samplerates, samplerate)
+
+    def __len__(self) -> int:
+        return len(self.bounds) - 1
+
+    def __iter__(self):
+        return zip(self.bounds[:-1].tolist(), self.bounds[1:].tolist())
+
+    @property
+    def starts(self) -> np.ndarray:
+        return self.bounds[:-1]
+
+    @property
+    def stops(self) -> np.ndarray:
+        return self.bounds[1:]
+
+    @property
+    def nbytes(self) -> int:
+        return self.bounds.nbytes + self.samplerates.nbytes
@@ -1,16 +1,20 @@
 import importlib.util
 import os
 import sys
-from functools import partial
+from functools import cache, partial
 from itertools import cycle
 
 import numpy as np
 import pathvalidate
+from pint import UnitRegistry
 from pyqtgraph.Qt import QtGui, QtWidgets
 
 sanitize_filename = partial(pathvalidate.sanitize_filename, platform="auto")
 sanitize_filepath = partial(pathvalidate.sanitize_filepath, platform="auto")
 
+# Set in the worker processes to report progress to the main window
+progressQueue = None
+
 
 def Colors():
     qtcolors = [
@@ -25,10 +29,21 @@ def Colors():
     return cycle(qtcolors)
 
 
-def estimateSampleRate(series):
-    intervals = np.diff(series.index)
-    # 1e9 to account for ns -> Hz
-    fs = 1e9 / np.median(intervals)
+@cache
+def unitRegistry() -> UnitRegistry:
+    # Building a registry is slow, one is shared by the whole process
+    return UnitRegistry()
+
+
+@cache
+def timeUnitToNs(timeunit: str) -> float:
+    ureg = unitRegistry()
+    return ureg.parse_expression(timeunit).to(ureg.nanosecond).magnitude
+
+
+def estimateSampleRate(segments):
+    # Time steps across gaps are left out
+    fs = segments.samplerate
     if fs == np.inf:
         fs = 0
     if fs > 1:
@@ -61,6 +76,17 @@ def loadmodule() -> None:
         sys.dont_write_bytecode = bcbak
 
 
+def setProgressQueue(queue) -> None:
+    # Executed in the worker processes at startup
+    global progressQueue
+    progressQueue = queue
+
+
+def reportProgress(label: str, fraction: float) -> None:
+    if progressQueue is not None:
+        progressQueue.put((label, fraction))
+
+
 def clip(vec, vrange):
     if vrange is None:
         return vec
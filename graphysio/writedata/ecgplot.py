@@ -2,23 +2,11 @@ from typing import List
 
 import ecg_plot
 import numpy as np
-from scipy import interpolate
 
+from graphysio.algorithms import resample
 from graphysio.plotwidgets.curves import CurveItem
 
 
-def interp_series(s, start, stop, npoints):
-    f = interpolate.interp1d(
-        s.index,
-        s.values,
-        assume_sorted=True,
-        copy=False,
-        fill_value="extrapolate",
-    )
-    newidx = np.linspace(start, stop, num=npoints)
-    return f(newidx)
-
-
 def export_curves(
     curves: List[CurveItem],
     filepath: str,
@@ -26,10 +14,14 @@ def export_curves(
 ) -> None:
     beginns = min(c.series.index[0] for c in curves)
     endns = max(c.series.index[-1] for c in curves)
-    duration_s = (endns - beginns) * 1e-9
     samplerate = int(max([c.samplerate for c in curves]))
-    npoints = int(duration_s * samplerate)
-    resampled = [interp_series(c.series, beginns, endns, npoints) for c in curves]
+    times = resample.grid(beginns, endns, samplerate)
+    resampled = []
+    for c in curves:
+        values = resample.resample(c.series.index, c.series, times)
+        # Dropouts are left blank on the plot
+        values[resample.ingaps(c.series.index, c.segments.bounds, times)] = np.nan
+        resampled.append(values)
     ecg = np.vstack(resampled)
     names = [c.name() for c in curves]
     ecg_plot.plot(
@@ -1,9 +1,7 @@
 from datetime import datetime
 from typing import List
 
-import numpy as np
-from scipy import interpolate
-
+from graphysio.algorithms import resample
 from graphysio.dialogs import askUserValue
 from graphysio.plotwidgets.curves import CurveItem
 from graphysio.structures import Parameter
@@ -16,21 +14,6 @@ else:
     is_available = True
 
 
-def interp_series(s, samplerate, start, stop):
-    f = interpolate.interp1d(
-        s.index,
-        s.values,
-        assume_sorted=True,
-        copy=False,
-        fill_value="extrapolate",
-    )
-    # Account for periods of missing data.
-    duration_s = (stop - start) * 1e-9
-    npoints = int(duration_s * samplerate)
-    newidx = np.linspace(start, stop, num=npoints)
-    return f(newidx)
-
-
 def curves_to_edf(
     curves: List[CurveItem],
     filepath: str,
@@ -64,7 +47,12 @@ def curves_to_edf(
             "dimension": dim,
         }
         headers.append(header)
-        resampled = interp_series(s, c.samplerate, beginns, endns)
+        times = resample.grid(beginns, endns, c.samplerate)
+        resampled = resample.resample(s.index, s.to_numpy(), times)
+        # Dropouts hold their last sample instead of being bridged
+        gaps = resample.ingaps(s.index, c.segments.bounds, times)
+        held = resample.resample(s.index, s.to_numpy(), times[gaps], "zero")
+        resampled[gaps] = held
         signals.append(resampled)
 
     edf = pyedflib.EdfWriter(